@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _nearest_centroids(vectors, centroids, block_size=65536):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_size):
+        block = _normalize(vectors[start:start + block_size])
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors, n_lists, n_iter=10, sample_size=100000, seed=0):
+    """
+    k-means on unit-normalised vectors (cosine assignment), trained on a sample
+    """
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), min(len(vectors), sample_size), replace=False))
+    sample = _normalize(vectors[sample_rows])
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+    for _ in range(n_iter):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        empty = counts == 0
+        # Re-seed empty lists with random sample points.
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index over dense vectors: the corpus is partitioned into n_lists
+    clusters by spherical k-means and each query is scored exactly against the
+    vectors of its nprobe closest clusters only. nprobe is the recall/latency knob:
+    nprobe = n_lists is exact search.
+
+    The vectors are stored again in list order (vectors.npy), so probing a list
+    reads one contiguous slice of the memory-mapped file.
+    """
+
+    def __init__(self, centroids, rows, offsets, vectors, norms):
+        self.centroids = centroids  # (n_lists, dim), unit norm
+        self.rows = rows            # corpus row of each stored vector, grouped by list
+        self.offsets = offsets      # list l holds stored vectors offsets[l]:offsets[l + 1]
+        self.vectors = vectors      # (docs, dim), list order
+        self.norms = norms          # L2 norm of each stored vector
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, n_iter=10, seed=0):
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(embeddings))))
+        n_lists = min(n_lists, len(embeddings))
+        centroids = spherical_kmeans(embeddings, n_lists, n_iter=n_iter, seed=seed)
+        assignments = _nearest_centroids(embeddings, centroids)
+        rows = np.argsort(assignments, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+        vectors = np.asarray(embeddings)[rows]
+        norms = np.linalg.norm(vectors.astype(np.float32), axis=1).astype(np.float32)
+        return cls(centroids, rows, offsets, vectors, norms)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'vectors.npy'), self.vectors)
+        np.savez(os.path.join(path, 'lists.npz'), centroids=self.centroids, rows=self.rows,
+                 offsets=self.offsets, norms=self.norms)
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump({'type': 'ivf-flat', 'n_lists': self.n_lists, 'size': len(self.rows)}, file)
+
+    @classmethod
+    def load(cls, path):
+        lists = np.load(os.path.join(path, 'lists.npz'))
+        vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        return cls(lists['centroids'], lists['rows'], lists['offsets'], vectors, lists['norms'])
+
+    def search(self, query_embeddings, top_k, nprobe=8, score_function="cos_sim"):
+        """
+        Approximate top-k; returns (corpus rows, scores) arrays of shape (queries, <=k), best first
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if score_function == "cos_sim":
+            queries = _normalize(queries)
+        elif score_function != "dot":
+            raise ValueError(f"Unknown score function: {score_function}")
+        nprobe = min(nprobe, self.n_lists)
+        probes = np.argpartition(-(_normalize(queries) @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        k = min(top_k, len(self.rows))
+        all_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in np.sort(probes[i])])
+            if not len(candidates):
+                continue
+            scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            if score_function == "cos_sim":
+                scores /= np.maximum(self.norms[candidates], 1e-12)
+            if len(scores) > k:
+                keep = np.argpartition(-scores, k - 1)[:k]
+                candidates, scores = candidates[keep], scores[keep]
+            order = np.argsort(-scores, kind='stable')
+            all_rows[i, :len(order)] = self.rows[candidates[order]]
+            all_scores[i, :len(order)] = scores[order]
+        return all_rows, all_scores
+
+
+def recall_at_k(approx_rows, exact_rows, k):
+    """
+    Mean fraction of the exact top-k found in the approximate top-k
+    """
+    hits = [len(set(a[:k]) & set(e[:k])) / max(1, min(k, len(e))) for a, e in zip(approx_rows, exact_rows)]
+    return float(np.mean(hits)) if hits else 1.0
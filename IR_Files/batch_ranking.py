@@ -0,0 +1,169 @@
+import numpy as np
+from scipy import sparse
+from collections import Counter
+
+
+BM25_VARIANTS = ("bm25", "bm25+", "bm25l", "bm25-adpt")
+# Default delta of the variants that use one (Lv & Zhai 2011)
+VARIANT_DELTAS = {"bm25+": 1.0, "bm25l": 0.5}
+# BM25-adpt: normalised tf levels r = 1..ADPT_MAX_LEVEL used to fit each term's k1
+ADPT_MAX_LEVEL = 32
+ADPT_K1_GRID = np.linspace(0.01, 3.0, 300)
+
+
+class BM25Matrix:
+    """
+    BM25 compiled into a sparse matrix of precomputed term weights.
+
+    weights is a terms x documents CSR matrix (the transpose of the doc x term
+    matrix, laid out exactly like the index postings) holding
+    idf(t) * (k1 + 1) * tf / (tf + k1 * (1 - b + b * dl / avgdl)). A batch of
+    queries becomes a sparse queries x terms matrix of query term frequencies, and
+    all BM25 scores come out of one sparse matrix product.
+
+    The posting arrays and collection statistics are kept, so term_weights() can
+    rebuild the weights for other parameters or BM25 variants without touching the index.
+    """
+
+    def __init__(self, bm25):
+        index = bm25.inverted_index
+        self.bm25 = bm25
+        self.index_version = index.version
+        self.doc_names = index.doc_names
+
+        terms, lengths, doc_id_chunks, tf_chunks = [], [], [], []
+        for term, postings in index.items():
+            terms.append(term)
+            lengths.append(len(postings))
+            doc_id_chunks.append(np.asarray(postings.doc_ids, dtype=np.int32))
+            tf_chunks.append(np.asarray(postings.tfs, dtype=np.float64))
+        self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+
+        self.dfs = np.asarray(lengths, dtype=np.int64)
+        self.indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(self.dfs, out=self.indptr[1:])
+        self.doc_ids = np.concatenate(doc_id_chunks) if doc_id_chunks else np.zeros(0, dtype=np.int32)
+        self.tfs = np.concatenate(tf_chunks) if tf_chunks else np.zeros(0)
+        self.doc_lengths = np.asarray(bm25.doc_lengths, dtype=np.float64)
+        self.N = bm25.N
+        self.avgdl = bm25.avgdl
+
+        idf = np.log((bm25.N - self.dfs + 0.5) / (self.dfs + 0.5) + 1)
+        norms = np.asarray(bm25.doc_norms, dtype=np.float64)
+        data = np.repeat(idf * (bm25.k1 + 1), self.dfs) * self.tfs / (self.tfs + norms[self.doc_ids])
+        self.weights = self._matrix(data)
+
+    def _matrix(self, data):
+        return sparse.csr_matrix((data, self.doc_ids, self.indptr), shape=(len(self.dfs), len(self.doc_lengths)))
+
+    def term_weights(self, k1=1.5, b=0.75, variant="bm25", delta=None):
+        """
+        Weight matrix for other parameters or a BM25 variant (Trotman et al. 2014):
+          bm25       log((N - df + 0.5) / (df + 0.5) + 1) * (k1 + 1) tf / (tf + k1 n)
+          bm25+      log((N + 1) / df) * ((k1 + 1) tf / (tf + k1 n) + delta)
+          bm25l      log((N + 1) / (df + 0.5)) * (k1 + 1)(c + delta) / (k1 + c + delta)
+          bm25-adpt  G1(t) * (k1(t) + 1) c / (k1(t) + c), with the information gain G1
+                     and k1(t) fitted per term from its tf distribution (Lv & Zhai 2011)
+        where n = 1 - b + b * dl / avgdl and c = tf / n.
+        """
+        if variant not in BM25_VARIANTS:
+            raise ValueError(f"Unknown BM25 variant: {variant}")
+        delta = VARIANT_DELTAS.get(variant, 0.0) if delta is None else delta
+        dfs = self.dfs.astype(np.float64)
+        norms = (1 - b + b * self.doc_lengths / self.avgdl)[self.doc_ids]
+        tfs = self.tfs
+        if variant == "bm25":
+            idf = np.log((self.N - dfs + 0.5) / (dfs + 0.5) + 1)
+            data = np.repeat(idf * (k1 + 1), self.dfs) * tfs / (tfs + k1 * norms)
+        elif variant == "bm25+":
+            idf = np.log((self.N + 1) / dfs)
+            data = np.repeat(idf, self.dfs) * ((k1 + 1) * tfs / (tfs + k1 * norms) + delta)
+        elif variant == "bm25l":
+            idf = np.log((self.N + 1) / (dfs + 0.5))
+            c = tfs / norms + delta
+            data = np.repeat(idf * (k1 + 1), self.dfs) * c / (k1 + c)
+        else:
+            c = tfs / norms
+            gain, term_k1 = self._adaptive_parameters(c, k1)
+            posting_k1 = np.repeat(term_k1, self.dfs)
+            data = np.repeat(gain, self.dfs) * (posting_k1 + 1) * c / (posting_k1 + c)
+        return self._matrix(data)
+
+    def _adaptive_parameters(self, c, default_k1):
+        """
+        BM25-adpt per-term information gain G1 and k1. With df_0 = N, df_1 = df and
+        df_r = #docs with c >= r - 0.5, G_r = log2((df_{r+1} + 0.5) / (df_r + 1)) -
+        log2((df_1 + 0.5) / (N + 1)); k1 minimises sum_r (G_r / G_1 - (k1 + 1) r / (k1 + r))^2
+        over ADPT_K1_GRID. Terms seen at a single level keep default_k1.
+        """
+        num_terms, levels = len(self.dfs), ADPT_MAX_LEVEL
+        term_of = np.repeat(np.arange(num_terms), self.dfs)
+        level = np.minimum(np.floor(c + 0.5), levels + 1).astype(np.int64)
+        counts = np.bincount(term_of * (levels + 2) + level, minlength=num_terms * (levels + 2))
+        at_least = np.cumsum(counts.reshape(num_terms, levels + 2)[:, ::-1], axis=1)[:, ::-1]
+        df = np.empty((num_terms, levels + 2))
+        df[:, 0] = self.N
+        df[:, 1] = self.dfs
+        df[:, 2:] = at_least[:, 2:]
+
+        base = np.log2((df[:, 1] + 0.5) / (self.N + 1))
+        gains = np.log2((df[:, 2:] + 0.5) / (df[:, 1:-1] + 1)) - base[:, None]  # G_r, r = 1..levels
+        g1 = gains[:, 0]
+        used = df[:, 1:-1] > 0
+        ratio = np.divide(gains, g1[:, None], out=np.zeros_like(gains), where=g1[:, None] != 0) * used
+        r = np.arange(1, levels + 1, dtype=np.float64)
+        model = (ADPT_K1_GRID[:, None] + 1) * r / (ADPT_K1_GRID[:, None] + r)  # (grid, levels)
+        error = (used.astype(np.float64) @ (model ** 2).T) - 2 * (ratio @ model.T)
+        term_k1 = ADPT_K1_GRID[np.argmin(error, axis=1)]
+        term_k1[used.sum(axis=1) < 2] = default_k1
+        return g1, term_k1
+
+    def query_matrix(self, queries):
+        """
+        Build the sparse queries x terms matrix of query term frequencies
+        """
+        indptr, indices, data = [0], [], []
+        for query_terms in queries:
+            for term, qtf in Counter(query_terms).items():
+                term_id = self.term_ids.get(term)
+                if term_id is not None:
+                    indices.append(term_id)
+                    data.append(qtf)
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int64),
+                                  np.asarray(indptr, dtype=np.int64)), shape=(len(queries), len(self.term_ids)))
+
+    def top_k(self, scores, k):
+        """
+        Select the k best (doc ID, score) pairs of each row of a sparse score matrix.
+        Ties are broken by doc ID, as in BM25.rank_documents.
+        """
+        results = []
+        for row in range(scores.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            row_scores, row_docs = scores.data[start:end], scores.indices[start:end]
+            if len(row_scores) > k:
+                # Keep everything tied with the k-th score so the doc ID tie-break is exact.
+                kth = row_scores[np.argpartition(-row_scores, k - 1)[k - 1]]
+                keep = row_scores >= kth
+                row_scores, row_docs = row_scores[keep], row_docs[keep]
+            order = np.lexsort((row_docs, -row_scores))[:k]
+            results.append((row_docs[order], row_scores[order]))
+        return results
+
+    def search(self, queries, top_k=1000, batch_size=256):
+        """
+        Score a {query_id: query terms} dict in batches of batch_size queries.
+        Returns results in the same format as BM25.search.
+        """
+        query_ids = list(queries)
+        query_terms = [q.split() if isinstance(q, str) else q for q in queries.values()]
+        doc_names = self.doc_names
+        results = {}
+        for start in range(0, len(query_ids), batch_size):
+            batch = query_terms[start:start + batch_size]
+            scores = (self.query_matrix(batch) @ self.weights).tocsr()
+            for query_id, (doc_ids, doc_scores) in zip(query_ids[start:start + batch_size],
+                                                       self.top_k(scores, top_k)):
+                results[query_id] = {doc_names[doc_id]: float(score) for doc_id, score in zip(doc_ids, doc_scores)}
+        return results
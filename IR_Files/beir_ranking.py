@@ -1,79 +1,163 @@
 # beir_ranking.py
-from beir.retrieval import models
-from beir.retrieval.search.dense import DenseRetrievalExactSearch as DRES
-from beir.retrieval.search.sparse import SparseSearch
-from beir.reranking.models import CrossEncoder
-from beir.reranking import Rerank
-from beir.retrieval.evaluation import EvaluateRetrieval
-import tensorflow as tf
-import json
+# Model backends (beir, sentence-transformers, tensorflow, torch) are imported by their
+# loaders on first use, so lexical-only runs never pay for them (see MODEL_LOADERS).
+from functools import lru_cache
 from ranking import BM25
+from indexing import BaseIndex
+from instrumentation import stage
+from runfile import write_run
+from utils import query_terms
 
-def load_model(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
-    if model_type == "bm25":
-        if documents is None or inverted_index is None or doc_lengths is None:
-            raise ValueError("Documents, inverted_index, and doc_lengths are required for BM25.")
-        return BM25(inverted_index, doc_lengths)
-    elif model_type == "sparta":
-        return SparseSearch(models.SPARTA(model_name), batch_size=128)
-    elif model_type in ["sentence-bert", "ance"]:
-        return DRES(models.SentenceBERT(model_name), batch_size=16)
+EMBEDDING_CACHE_DIR = 'embeddings'  # Set to None to re-encode the corpus on every run
+DENSE_ANN = None  # Set to "ivf" for approximate dense search (requires the embedding cache)
+ANN_NPROBE = 8    # IVF lists probed per query: higher = better recall, slower
+
+# Hybrid retrieval: BM25 candidates scored with the model_name dense encoder
+HYBRID_DENSE_TYPE = "sentence-bert"  # Model type of the dense encoder
+HYBRID_CANDIDATES = 100              # BM25 candidates per query passed to the dense encoder
+HYBRID_FUSION = "minmax"             # "sum", "minmax", "zscore", "rrf", or None to rank by the dense score only
+HYBRID_WEIGHTS = (0.5, 0.5)          # (BM25, dense) fusion weights
+
+# Cross-encoder reranking (rerank=True)
+RERANK_MODEL = "cross-encoder/ms-marco-electra-base"
+RERANK_DEPTH = 100                      # First-stage documents reranked per query
+RERANK_BATCH_SIZE = 128                 # Maximum pairs per batch; batches are also capped in padded tokens
+RERANK_CACHE = 'rerank_scores.sqlite'   # Persistent pair score cache; set to None to disable
+
+# model_type -> loader(model_name, model_type, documents, inverted_index, doc_lengths)
+MODEL_LOADERS = {}
+
+def register_model(*model_types):
+    """
+    Register the decorated function as the loader of the given model types
+    """
+    def decorator(loader):
+        for model_type in model_types:
+            MODEL_LOADERS[model_type] = loader
+        return loader
+    return decorator
+
+def dense_search(model, model_name, batch_size=128, cache_dir=EMBEDDING_CACHE_DIR, ann=DENSE_ANN, nprobe=ANN_NPROBE):
+    if cache_dir is None:
+        from beir.retrieval.search.dense import DenseRetrievalExactSearch as DRES
+        return DRES(model, batch_size=batch_size)
+    from dense_cache import CachedDenseSearch
+    return CachedDenseSearch(model, model_name, batch_size=batch_size, cache_dir=cache_dir, ann=ann, nprobe=nprobe)
+
+def load_encoder(model_name, model_type):
+    """
+    BEIR dense encoder for model_type, with the name it is cached under and its batch size
+    """
+    from beir.retrieval import models
+    if model_type in ["sentence-bert", "ance"]:
+        return models.SentenceBERT(model_name), model_name, 16
     elif model_type == "use-qa":
-        return DRES(models.UseQA(model_name))
+        return models.UseQA(model_name), model_name, 128
     elif model_type == "dpr":
-        return DRES(models.SentenceBERT((
+        return models.SentenceBERT((
     "facebook-dpr-question_encoder-multiset-base",
     "facebook-dpr-ctx_encoder-multiset-base",
-    " [SEP] "), batch_size=128))
-    elif model_type == "cross-encoder":
-        return CrossEncoder(model_name)
+    " [SEP] "), batch_size=128), "facebook-dpr-multiset-base", 128
     else:
+        raise ValueError(f"Unknown dense model type: {model_type}")
+
+@register_model("bm25")
+def _load_bm25(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
+    if documents is None or inverted_index is None or (doc_lengths is None and not isinstance(inverted_index, BaseIndex)):
+        raise ValueError("Documents, inverted_index, and doc_lengths are required for BM25.")
+    return BM25(inverted_index, doc_lengths)
+
+@register_model("bm25-rm3")
+def _load_bm25_rm3(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
+    from feedback import RM3
+    return RM3(_load_bm25(model_name, "bm25", documents, inverted_index, doc_lengths))
+
+@register_model("sparta")
+def _load_sparta(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
+    from beir.retrieval import models
+    from beir.retrieval.search.sparse import SparseSearch
+    return SparseSearch(models.SPARTA(model_name), batch_size=128)
+
+@register_model("sentence-bert", "ance", "use-qa", "dpr")
+def _load_dense(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
+    return dense_search(*load_encoder(model_name, model_type))
+
+@register_model("hybrid")
+def _load_hybrid(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
+    from hybrid import HybridSearch
+    bm25 = load_model(model_name, "bm25", documents, inverted_index, doc_lengths)
+    encoder, encoder_name, batch_size = load_encoder(model_name, HYBRID_DENSE_TYPE)
+    return HybridSearch(bm25, encoder, encoder_name, batch_size=batch_size, cache_dir=EMBEDDING_CACHE_DIR,
+                        candidates=HYBRID_CANDIDATES, weights=HYBRID_WEIGHTS, method=HYBRID_FUSION)
+
+@register_model("cross-encoder")
+def _load_cross_encoder(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
+    from beir.reranking.models import CrossEncoder
+    return CrossEncoder(model_name)
+
+def load_model(model_name, model_type, documents=None, inverted_index=None, doc_lengths=None):
+    loader = MODEL_LOADERS.get(model_type)
+    if loader is None:
         raise ValueError(f"Unknown model type: {model_type}")
+    return loader(model_name, model_type, documents, inverted_index, doc_lengths)
     
-def combine_scores(scores1, scores2, weight1=0.5, weight2=0.5):
-    combined_scores = {}
-    for doc_id in scores1:
-        combined_scores[doc_id] = scores1[doc_id] * weight1
-    for doc_id in scores2:
-        if doc_id in combined_scores:
-            combined_scores[doc_id] += scores2[doc_id] * weight2
-        else:
-            combined_scores[doc_id] = scores2[doc_id] * weight2
-    return combined_scores
+@lru_cache(maxsize=None)
+def load_reranker(model_name=RERANK_MODEL, depth=RERANK_DEPTH, batch_size=RERANK_BATCH_SIZE, cache_path=RERANK_CACHE):
+    """
+    Cross-encoder reranker, loaded once per process for each configuration
+    """
+    from reranker import CrossEncoderReranker
+    return CrossEncoderReranker(load_model(model_name, "cross-encoder"), model_name, batch_size=batch_size,
+                                depth=depth, cache_path=cache_path)
+
+def combine_scores(scores1, scores2, weight1=0.5, weight2=0.5, method="sum"):
+    """
+    Fuse two {doc_id: score} dicts; method as in fusion.fuse_query ("sum" adds the weighted raw scores)
+    """
+    from fusion import fuse_query
+    ranked = fuse_query([list(scores1.items()), list(scores2.items())], [weight1, weight2], method,
+                        depth=len(scores1) + len(scores2))
+    return dict(ranked)
+
+PARSER_PLACEHOLDERS = {'NO_TITLE', 'NO_TEXT', 'NO_QUERY', 'NO_NARRATIVE'}
+
+def _text(*fields):
+    # Join parsed text fields, skipping the parser's placeholders for missing ones
+    return " ".join(field for field in fields if field and field not in PARSER_PLACEHOLDERS)
 
 def rank_documents(documents, queries, model_name="BM25", model_type="BM25", rerank=False, inverted_index=None, doc_lengths=None):
     model = load_model(model_name, model_type, documents, inverted_index, doc_lengths)
     corpus = {}
     for doc in documents:
         corpus[doc['DOCNO']] = {
-            "title": " ".join(doc['HEAD']),
-            "text": " ".join(doc['TEXT'])
+            "title": _text(doc['HEAD']),
+            "text": _text(doc['TEXT'])
         }
-    score_function = "cos_sim" if model_type != "bm25" else None
-    if model_type == "ance": score_function = "dot"
-    retriever = EvaluateRetrieval(model, score_function=score_function)
+    score_function = "cos_sim" if model_type not in ("bm25", "bm25-rm3") else None
+    if model_type == "ance" or (model_type == "hybrid" and HYBRID_DENSE_TYPE == "ance"): score_function = "dot"
     
     # Convert queries to the correct format
-    query_dict = {query['num']: " ".join(query['title'] + query['query'] + query['narrative']) for query in queries}
+    query_dict = {query['num']: _text(query['title'], query['query'], query['narrative']) for query in queries}
     
-    if model_type == "bm25":
-        results = model.search(corpus, query_dict)
-    else:
-        results = retriever.retrieve(corpus, query_dict)
+    with stage("retrieve"):
+        if model_type in ("bm25", "bm25-rm3"):
+            results = model.search(corpus, {query['num']: query_terms(query) for query in queries})
+        elif model_type == "hybrid":
+            results = model.search(corpus, query_dict, score_function=score_function,
+                                   query_terms={query['num']: query_terms(query) for query in queries})
+        else:
+            from beir.retrieval.evaluation import EvaluateRetrieval
+            retriever = EvaluateRetrieval(model, score_function=score_function)
+            results = retriever.retrieve(corpus, query_dict)
     
     if rerank:
-        reranker = Rerank(load_model("cross-encoder/ms-marco-electra-base", "cross-encoder"), batch_size=128)
-        results = reranker.rerank(corpus, query_dict, results, top_k=100)
+        with stage("rerank"):
+            results = load_reranker().rerank(corpus, query_dict, results)
     
     return results
 
 def save_results(results, output_file):
-    beir_results = {}
-    for query_id, docs in results.items():
-        beir_results[query_id] = [(doc_id, float(score)) for doc_id, score in docs.items()]
-    
-    with open(output_file, 'w') as file:
-        json.dump(beir_results, file, indent=4)
+    write_run(output_file, ((query_id, docs.items()) for query_id, docs in results.items()))
 
 # Example usage:
 # corpus, queries, qrels = GenericDataLoader("scifact/").load(split="test")
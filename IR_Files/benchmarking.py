@@ -1,20 +1,18 @@
-import json
-from beir.datasets.data_loader import GenericDataLoader
-from beir.retrieval.evaluation import EvaluateRetrieval
+from evaluation import Evaluator, load_qrels
 
-dataset = "trec-covid"  # Change this to the actual dataset being used
-corpus, queries, qrels = GenericDataLoader(dataset + "/").load(split="test")
+dataset = "scifact"  # Change this to the actual dataset being used
+qrels = load_qrels(dataset + "/qrels/test.tsv")
 
-results_file = 'Results.json'
-with open(results_file, 'r') as file:
-    raw_results = json.load(file)
+results_file = 'Results.json'  # JSON or binary (*.run) run file
+baseline_file = None           # Set to a second run file for a paired significance test
 
-evaluator = EvaluateRetrieval()
+evaluator = Evaluator(qrels, k_values=[1, 5, 10, 100])
 
-beir_results = {}
-for query_id, docs in raw_results.items():
-    beir_results[query_id] = {doc_id: score for doc_id, score in docs}
-
-results = evaluator.evaluate(qrels, beir_results, k_values=[1, 5, 10, 100])
+results = evaluator.evaluate(results_file)
 
 print("Evaluation Results:", results)
+
+if baseline_file is not None:
+    comparison = evaluator.compare(baseline_file, results_file, metrics=["NDCG@10", "MAP@100", "Recall@100"])
+    for metric, stats in comparison.items():
+        print(f"{metric}: baseline {stats['a']:.4f}, run {stats['b']:.4f}, delta {stats['delta']:+.4f}, p = {stats['p_value']:.4f}")
@@ -0,0 +1,173 @@
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+import sys
+
+import numpy as np
+
+# Postings are cut into blocks of this many entries; the skip table holds one entry per block.
+DEFAULT_BLOCK_SIZE = 128
+# Shorter buffers are decoded in pure Python: for them NumPy's per-call overhead dominates.
+_NUMPY_DECODE_BYTES = 256
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def vbyte_encode(values):
+    """
+    Variable-byte encode non-negative integers: 7 bits per byte, least significant
+    group first, the high bit set on every byte except the last of each value
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        num_bytes += values >= np.uint64(1) << np.uint64(7 * k)
+    groups = np.arange(num_bytes.max(), dtype=np.uint64)
+    table = ((values[:, None] >> (np.uint64(7) * groups)) & np.uint64(0x7f)).astype(np.uint8)
+    table[groups[None, :] < (num_bytes[:, None] - 1).astype(np.uint64)] |= 0x80
+    return table[groups[None, :] < num_bytes[:, None].astype(np.uint64)].tobytes()
+
+
+def vbyte_decode(data):
+    """
+    Decode a buffer written by vbyte_encode into an int64 array
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    last = (data & 0x80) == 0
+    starts = np.empty(int(last.sum()), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = np.flatnonzero(last)[:-1] + 1
+    value_of_byte = np.cumsum(last) - last
+    shifts = 7 * (np.arange(len(data)) - starts[value_of_byte])
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+
+def _decode_list(data):
+    if len(data) >= _NUMPY_DECODE_BYTES:
+        return vbyte_decode(data).tolist()
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def encode_postings(doc_ids, tfs, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Compress one postings list (ascending doc IDs). Layout, for B blocks (integers little-endian):
+      last doc ID of each block (u32 x B), end offset of each block's data (u32 x B),
+      then per block the doc ID gaps and the term frequencies, both VByte encoded.
+    Gaps are taken from the previous block's last doc ID, so a block decodes on its own.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    tfs = np.asarray(tfs, dtype=np.int64)
+    gaps = np.diff(doc_ids, prepend=0)
+    last_docs, ends, blocks = [], [], []
+    end = 0
+    for start in range(0, len(doc_ids), block_size):
+        block = vbyte_encode(np.concatenate([gaps[start:start + block_size], tfs[start:start + block_size]]))
+        end += len(block)
+        last_docs.append(int(doc_ids[min(start + block_size, len(doc_ids)) - 1]))
+        ends.append(end)
+        blocks.append(block)
+    return (np.array(last_docs, dtype='<u4').tobytes() + np.array(ends, dtype='<u4').tobytes()
+            + b''.join(blocks))
+
+
+class CompressedPostings:
+    """
+    Postings list over an encode_postings buffer, with the same interface as
+    indexing.Postings. Full traversals (items) decode the whole list in one vectorised
+    pass; lookups of a few doc IDs binary search the skip table and decode only the
+    blocks that can contain them.
+    """
+    __slots__ = ('_data', '_count', '_block_size', '_last_docs', '_ends', '_decoded')
+
+    def __init__(self, data, count, block_size=DEFAULT_BLOCK_SIZE):
+        num_blocks = -(-count // block_size)
+        self._count = count
+        self._block_size = block_size
+        self._last_docs = data[:4 * num_blocks].cast('I')
+        self._ends = data[4 * num_blocks:8 * num_blocks].cast('I')
+        if _BIG_ENDIAN:
+            self._last_docs, self._ends = array('I', self._last_docs), array('I', self._ends)
+            self._last_docs.byteswap()
+            self._ends.byteswap()
+        # The data ends with the last block; the index pads each list to 4 bytes after it.
+        self._data = data[8 * num_blocks:8 * num_blocks + (self._ends[-1] if num_blocks else 0)]
+        self._decoded = None
+
+    def __len__(self):
+        return self._count
+
+    def _decode(self):
+        # Blocks are [gaps, tfs] pairs: split them, then one running sum restores the doc IDs.
+        if self._decoded is None:
+            values = _decode_list(self._data)
+            gaps, tfs = [], []
+            for start in range(0, self._count, self._block_size):
+                size = min(self._block_size, self._count - start)
+                gaps += values[2 * start:2 * start + size]
+                tfs += values[2 * start + size:2 * (start + size)]
+            self._decoded = (list(accumulate(gaps)), tfs)
+        return self._decoded
+
+    @property
+    def doc_ids(self):
+        return self._decode()[0]
+
+    @property
+    def tfs(self):
+        return self._decode()[1]
+
+    def _block(self, block):
+        start = self._ends[block - 1] if block else 0
+        values = _decode_list(self._data[start:self._ends[block]])
+        half = len(values) // 2
+        base = self._last_docs[block - 1] if block else 0
+        return list(accumulate(values[:half], initial=base))[1:], values[half:]
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def items(self):
+        return zip(*self._decode())
+
+    def lookup(self, doc_ids):
+        """
+        (doc_id, tf) for each of doc_ids that occurs in the postings
+        """
+        if self._decoded is not None:
+            yield from _lookup_sorted(self._decoded[0], self._decoded[1], doc_ids)
+            return
+        wanted = {}
+        last_docs, num_blocks = self._last_docs, len(self._last_docs)
+        for doc_id in doc_ids:
+            block = bisect_left(last_docs, doc_id)
+            if block < num_blocks:
+                wanted.setdefault(block, []).append(doc_id)
+        for block, block_doc_ids in wanted.items():
+            yield from _lookup_sorted(*self._block(block), block_doc_ids)
+
+    def __contains__(self, doc_id):
+        return any(True for _ in self.lookup([doc_id]))
+
+    def __getitem__(self, doc_id):
+        for _, tf in self.lookup([doc_id]):
+            return tf
+        raise KeyError(doc_id)
+
+
+def _lookup_sorted(sorted_doc_ids, tfs, doc_ids):
+    num_postings = len(sorted_doc_ids)
+    for doc_id in doc_ids:
+        pos = bisect_left(sorted_doc_ids, doc_id)
+        if pos < num_postings and sorted_doc_ids[pos] == doc_id:
+            yield doc_id, tfs[pos]
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from ann import IVFFlatIndex, recall_at_k
+from instrumentation import count, timer
+
+
+def corpus_hash(corpus):
+    """
+    Content hash of a BEIR corpus ({doc_id: {"title", "text"}}), independent of dict order
+    """
+    digest = hashlib.sha256()
+    for doc_id in sorted(corpus):
+        doc = corpus[doc_id]
+        for field in (doc_id, doc.get('title', ''), doc.get('text', '')):
+            data = field.encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _to_numpy(embeddings):
+    # Encoders return NumPy arrays, torch tensors or TensorFlow tensors.
+    if hasattr(embeddings, 'cpu'):
+        embeddings = embeddings.cpu()
+    if hasattr(embeddings, 'numpy'):
+        embeddings = embeddings.numpy()
+    return np.asarray(embeddings)
+
+
+class EmbeddingStore:
+    """
+    On-disk cache of corpus embeddings, one directory per (model name, corpus hash):
+      embeddings.npy  (docs x dim) float32 or float16 matrix, opened memory-mapped
+      norms.npy       float32 L2 norm of each row, for cosine similarity
+      doc_ids.json    row -> doc ID sidecar
+      meta.json       model name, corpus hash, dtype and shape
+    """
+
+    def __init__(self, cache_dir, model_name, corpus_digest):
+        safe_name = re.sub(r'[^A-Za-z0-9._-]+', '_', model_name).strip('_')
+        self.path = os.path.join(cache_dir, f"{safe_name}-{corpus_digest[:16]}")
+        self.model_name = model_name
+        self.corpus_digest = corpus_digest
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, 'meta.json'))
+
+    def save(self, doc_ids, embeddings, dtype=np.float32):
+        os.makedirs(self.path, exist_ok=True)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        np.save(os.path.join(self.path, 'embeddings.npy'), embeddings.astype(dtype, copy=False))
+        np.save(os.path.join(self.path, 'norms.npy'), np.linalg.norm(embeddings, axis=1).astype(np.float32))
+        with open(os.path.join(self.path, 'doc_ids.json'), 'w', encoding='utf-8') as file:
+            json.dump(list(doc_ids), file)
+        # meta.json is written last and marks the entry as complete.
+        with open(os.path.join(self.path, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump({'model': self.model_name, 'corpus_hash': self.corpus_digest,
+                       'dtype': np.dtype(dtype).name, 'shape': list(embeddings.shape)}, file)
+
+    def load(self):
+        """
+        Return (doc_ids, embeddings, norms) with the embedding matrix memory-mapped
+        """
+        with open(os.path.join(self.path, 'doc_ids.json'), 'r', encoding='utf-8') as file:
+            doc_ids = json.load(file)
+        embeddings = np.load(os.path.join(self.path, 'embeddings.npy'), mmap_mode='r')
+        norms = np.load(os.path.join(self.path, 'norms.npy'))
+        return doc_ids, embeddings, norms
+
+
+def top_k_scores(query_embeddings, embeddings, norms, top_k, score_function="cos_sim", block_size=65536):
+    """
+    Exact top-k over a (possibly memory-mapped) embedding matrix, scanned in row blocks.
+    Returns (row indices, scores) arrays of shape (queries, k), best first.
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    if score_function == "cos_sim":
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    elif score_function != "dot":
+        raise ValueError(f"Unknown score function: {score_function}")
+    k = min(top_k, embeddings.shape[0])
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, embeddings.shape[0], block_size):
+        block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+        scores = queries @ block.T
+        if score_function == "cos_sim":
+            scores /= np.maximum(norms[start:start + block_size], 1e-12)
+        rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        best_scores, best_rows = scores, rows
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class CachedDenseSearch:
+    """
+    Dense retrieval with a persistent corpus-embedding cache.
+
+    A drop-in replacement for BEIR's DenseRetrievalExactSearch: the corpus is encoded
+    once per (model name, corpus content hash) and stored in an EmbeddingStore, so
+    later runs only encode the queries and score them with a blocked matmul plus
+    top-k over the memory-mapped matrix.
+
+    With ann="ivf" queries are answered by an IVF-flat index (see ann.IVFFlatIndex)
+    built on first use and stored next to the cached embeddings; nprobe trades
+    recall for latency and recall_check() measures recall@k against exact search.
+    """
+
+    def __init__(self, model, model_name, batch_size=128, cache_dir='embeddings', dtype=np.float32,
+                 ann=None, n_lists=None, nprobe=8):
+        if ann not in (None, "ivf"):
+            raise ValueError(f"Unknown ANN backend: {ann}")
+        self.model = model
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.dtype = dtype
+        self.ann = ann
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self._store = None
+        self._ann_index = None
+        self._loaded = None  # (corpus, (doc_ids, embeddings, norms)) of the last call
+
+    def corpus_embeddings(self, corpus):
+        """
+        Return (doc_ids, embeddings, norms), encoding and caching the corpus on a cache miss.
+        Passing the same corpus object again (as the query server does) skips hashing and
+        reloading it, so the corpus must not be modified in between.
+        """
+        if self._loaded is not None and self._loaded[0] is corpus:
+            return self._loaded[1]
+        store = EmbeddingStore(self.cache_dir, self.model_name, corpus_hash(corpus))
+        if not store.exists():
+            # Longest documents first, as DRES does, so batches have similar lengths.
+            doc_ids = sorted(corpus, key=lambda doc_id: len(corpus[doc_id].get('title', '') + corpus[doc_id].get('text', '')),
+                             reverse=True)
+            print(f"Encoding {len(doc_ids)} documents with {self.model_name}")
+            count("dense.embedding_cache_misses")
+            with timer("dense.encode_corpus"):
+                embeddings = self.model.encode_corpus([corpus[doc_id] for doc_id in doc_ids], batch_size=self.batch_size)
+            store.save(doc_ids, _to_numpy(embeddings), self.dtype)
+        else:
+            print(f"Loading cached corpus embeddings from {store.path}")
+            count("dense.embedding_cache_hits")
+        if self._store is None or self._store.path != store.path:
+            self._store, self._ann_index = store, None
+        self._loaded = (corpus, store.load())
+        return self._loaded[1]
+
+    def ann_index(self, embeddings):
+        """
+        Load the IVF index stored with the current embeddings, building it on first use
+        """
+        if self._ann_index is None:
+            path = os.path.join(self._store.path, f"ivf-{self.n_lists or 'auto'}")
+            if os.path.exists(os.path.join(path, 'meta.json')):
+                self._ann_index = IVFFlatIndex.load(path)
+            else:
+                print(f"Building IVF index over {len(embeddings)} embeddings")
+                self._ann_index = IVFFlatIndex.build(embeddings, self.n_lists)
+                self._ann_index.save(path)
+        return self._ann_index
+
+    def _encode_queries(self, queries, query_ids):
+        count("dense.queries_encoded", len(query_ids))
+        with timer("dense.encode_queries"):
+            return _to_numpy(self.model.encode_queries([queries[qid] for qid in query_ids], batch_size=self.batch_size))
+
+    def search(self, corpus, queries, top_k, score_function="cos_sim", **kwargs):
+        doc_ids, embeddings, norms = self.corpus_embeddings(corpus)
+        query_ids = list(queries)
+        query_embeddings = self._encode_queries(queries, query_ids)
+        with timer("dense.score"):
+            if self.ann == "ivf":
+                rows, scores = self.ann_index(embeddings).search(query_embeddings, top_k, self.nprobe, score_function)
+            else:
+                rows, scores = top_k_scores(query_embeddings, embeddings, norms, top_k, score_function)
+        return {query_id: {doc_ids[row]: float(score) for row, score in zip(rows[i], scores[i]) if row >= 0}
+                for i, query_id in enumerate(query_ids)}
+
+    def recall_check(self, corpus, queries, top_k=100, score_function="cos_sim"):
+        """
+        Report recall@top_k of the IVF index (at the configured nprobe) against exact search
+        """
+        doc_ids, embeddings, norms = self.corpus_embeddings(corpus)
+        query_embeddings = self._encode_queries(queries, list(queries))
+        exact_rows, _ = top_k_scores(query_embeddings, embeddings, norms, top_k, score_function)
+        approx_rows, _ = self.ann_index(embeddings).search(query_embeddings, top_k, self.nprobe, score_function)
+        recall = recall_at_k(approx_rows, exact_rows, top_k)
+        print(f"IVF recall@{top_k} vs exact search (n_lists={self._ann_index.n_lists}, nprobe={self.nprobe}): {recall:.4f}")
+        return recall
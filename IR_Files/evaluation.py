@@ -0,0 +1,184 @@
+import csv
+from collections import namedtuple
+
+import numpy as np
+
+from runfile import RunFile, is_binary_run, load_run
+
+DEFAULT_K_VALUES = (1, 3, 5, 10, 100, 1000)
+
+# Columnar run: query q owns doc_rows/scores[offsets[q]:offsets[q + 1]]; doc_rows index doc_names.
+RunColumns = namedtuple('RunColumns', 'query_ids offsets doc_rows scores doc_names')
+
+
+def load_qrels(tsv_path):
+    """
+    Load a BEIR qrels TSV (query-id, corpus-id, score) as {query_id: {doc_id: relevance}}
+    """
+    qrels = {}
+    with open(tsv_path, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file, delimiter='\t'):
+            qrels.setdefault(row['query-id'], {})[row['corpus-id']] = int(row['score'])
+    return qrels
+
+
+def _run_columns(run):
+    """
+    RunColumns view of a run. Accepts RunColumns, a run file path, a RunFile, or
+    {query_id: {doc_id: score} or [(doc_id, score), ...]}.
+    """
+    if isinstance(run, RunColumns):
+        return run
+    if isinstance(run, str):
+        run = RunFile(run) if is_binary_run(run) else load_run(run)
+    if isinstance(run, RunFile):
+        return RunColumns(list(run.query_ids), np.frombuffer(run.entry_offsets, dtype=np.uint64).astype(np.int64),
+                          np.frombuffer(run.doc_rows, dtype=np.int32), np.frombuffer(run.scores, dtype=np.float32),
+                          run.doc_ids[:])
+    doc_index, offsets, rows, scores = {}, [0], [], []
+    for ranked in run.values():
+        for doc_id, score in (ranked.items() if isinstance(ranked, dict) else ranked):
+            rows.append(doc_index.setdefault(doc_id, len(doc_index)))
+            scores.append(score)
+        offsets.append(len(rows))
+    return RunColumns(list(run), np.array(offsets, dtype=np.int64), np.array(rows, dtype=np.int32),
+                      np.array(scores, dtype=np.float64), list(doc_index))
+
+
+class Evaluator:
+    """
+    Evaluate runs against qrels with NumPy: nDCG@k, MAP@k, Recall@k, P@k and MRR@k
+    for all k in one pass.
+
+    The run's (query, doc) entries are encoded as integer keys and joined against the
+    sorted keys of the relevant documents with a binary search; only the hits within
+    the largest cut-off are kept, and every metric at every cut-off is a per-query
+    weighted count of those hits (np.bincount). Definitions follow trec_eval as used
+    by BEIR: linear gains for nDCG, AP and recall normalised by all relevant
+    documents, P@k divided by k, and only queries present in both the run and the
+    qrels are averaged. Documents with equal scores are ranked as trec_eval does, by
+    doc ID in decreasing order.
+    """
+
+    def __init__(self, qrels, k_values=DEFAULT_K_VALUES):
+        self.qrels = load_qrels(qrels) if isinstance(qrels, str) else qrels
+        self.k_values = sorted(k_values)
+        # Per-query ideal DCG at each cut-off and number of relevant documents depend only on the qrels.
+        discounts = 1.0 / np.log2(np.arange(2, self.k_values[-1] + 2))
+        self._idcg, self._num_relevant = {}, {}
+        for query_id, judged in self.qrels.items():
+            gains = sorted((relevance for relevance in judged.values() if relevance > 0), reverse=True)
+            ideal = np.cumsum(np.array(gains[:self.k_values[-1]], dtype=np.float64) * discounts[:len(gains)])
+            self._idcg[query_id] = np.array([ideal[min(k, len(ideal)) - 1] if len(ideal) else 0.0
+                                             for k in self.k_values])
+            self._num_relevant[query_id] = len(gains)
+
+    def per_query(self, run):
+        """
+        Return (query IDs, {metric name: array of per-query values}), metric names as "NDCG@10"
+        """
+        query_ids, offsets, rows, scores, doc_names = _run_columns(run)
+        depth = self.k_values[-1]
+        kept = [i for i, query_id in enumerate(query_ids) if query_id in self.qrels]
+        row_of = {doc_id: row for row, doc_id in enumerate(doc_names)}
+        num_docs = max(1, len(doc_names))
+
+        # (query, doc row) keys of the relevant documents this run could retrieve.
+        keys, key_gains = [], []
+        for i in kept:
+            for doc_id, relevance in self.qrels[query_ids[i]].items():
+                if relevance > 0 and doc_id in row_of:
+                    keys.append(i * num_docs + row_of[doc_id])
+                    key_gains.append(relevance)
+        keys = np.array(keys, dtype=np.int64)
+        order = np.argsort(keys)
+        keys, key_gains = keys[order], np.array(key_gains, dtype=np.float64)[order]
+
+        # Rank the entries of each query by score and keep the relevant ones within depth.
+        entry_query = np.repeat(np.arange(len(query_ids)), np.diff(offsets))
+        # Run files are normally written best first; only sort when they are not, or have ties.
+        same_query = np.diff(entry_query) == 0
+        if not ((np.diff(scores) <= 0) | ~same_query).all() or ((np.diff(scores) == 0) & same_query).any():
+            name_order = np.empty(len(doc_names), dtype=np.int64)
+            name_order[sorted(range(len(doc_names)), key=doc_names.__getitem__)] = np.arange(len(doc_names))
+            order = np.lexsort((-name_order[rows], -scores.astype(np.float64), entry_query))
+            entry_query, rows = entry_query[order], rows[order]
+        ranks = np.arange(len(entry_query)) - offsets[entry_query]
+        entry_keys = entry_query * num_docs + rows
+        if len(keys):
+            found = np.minimum(np.searchsorted(keys, entry_keys), len(keys) - 1)
+            hit = (keys[found] == entry_keys) & (ranks < depth)
+        else:
+            found, hit = np.zeros(len(entry_keys), dtype=np.int64), np.zeros(len(entry_keys), dtype=bool)
+
+        # Hits are few: every metric is a per-query weighted count over them.
+        position_of = np.full(len(query_ids), -1)
+        position_of[kept] = np.arange(len(kept))
+        hit_query, hit_rank, hit_gain = position_of[entry_query[hit]], ranks[hit], key_gains[found[hit]]
+        hit_number = np.arange(len(hit_query)) - np.searchsorted(hit_query, hit_query) + 1
+        first_hit = np.full(len(kept), depth)
+        np.minimum.at(first_hit, hit_query, hit_rank)
+        idcg = np.array([self._idcg[query_ids[i]] for i in kept]).reshape(len(kept), len(self.k_values))
+        num_relevant = np.array([self._num_relevant[query_ids[i]] for i in kept], dtype=np.float64)
+
+        metrics = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for column, k in enumerate(self.k_values):
+                within = hit_rank < k
+                count = lambda weights=None: np.bincount(hit_query[within], weights, minlength=len(kept))
+                dcg = count(hit_gain[within] / np.log2(hit_rank[within] + 2))
+                hits = count()
+                metrics[f"NDCG@{k}"] = np.where(idcg[:, column] > 0, dcg / idcg[:, column], 0.0)
+                metrics[f"MAP@{k}"] = np.where(num_relevant > 0, count(hit_number[within] / (hit_rank[within] + 1)) / num_relevant, 0.0)
+                metrics[f"Recall@{k}"] = np.where(num_relevant > 0, hits / num_relevant, 0.0)
+                metrics[f"P@{k}"] = hits / k
+                metrics[f"MRR@{k}"] = np.where(first_hit < k, 1.0 / (first_hit + 1), 0.0)
+        return [query_ids[i] for i in kept], metrics
+
+    def evaluate(self, run):
+        """
+        Mean of every metric over the evaluated queries, as {metric name: value}
+        """
+        _, metrics = self.per_query(run)
+        return {name: float(values.mean()) if len(values) else 0.0 for name, values in metrics.items()}
+
+    def compare(self, run_a, run_b, metrics=None, method="randomization", n_resamples=10000, seed=0):
+        """
+        Paired comparison of two runs on the queries both were evaluated on:
+        {metric name: {"a", "b", "delta", "p_value"}} (see paired_test)
+        """
+        query_ids_a, metrics_a = self.per_query(run_a)
+        query_ids_b, metrics_b = self.per_query(run_b)
+        position_b = {query_id: i for i, query_id in enumerate(query_ids_b)}
+        common = [(i, position_b[query_id]) for i, query_id in enumerate(query_ids_a) if query_id in position_b]
+        rows_a = np.array([i for i, _ in common], dtype=np.int64)
+        rows_b = np.array([j for _, j in common], dtype=np.int64)
+        comparison = {}
+        for name in metrics or metrics_a:
+            a, b = metrics_a[name][rows_a], metrics_b[name][rows_b]
+            comparison[name] = {"a": float(a.mean()) if len(a) else 0.0, "b": float(b.mean()) if len(b) else 0.0,
+                                "delta": float((b - a).mean()) if len(a) else 0.0,
+                                "p_value": paired_test(a, b, method, n_resamples, seed)}
+        return comparison
+
+
+def paired_test(scores_a, scores_b, method="randomization", n_resamples=10000, seed=0):
+    """
+    Two-sided p-value for the mean per-query difference of two runs: a paired
+    randomization (sign-flip) test, or a paired t-test with method="t" (needs scipy)
+    """
+    differences = np.asarray(scores_b, dtype=np.float64) - np.asarray(scores_a, dtype=np.float64)
+    if not len(differences) or not differences.any():
+        return 1.0
+    if method == "t":
+        from scipy.stats import ttest_rel  # scipy is only needed for the t-test
+        return float(ttest_rel(scores_b, scores_a).pvalue)
+    if method != "randomization":
+        raise ValueError(f"Unknown significance test: {method}")
+    rng = np.random.default_rng(seed)
+    observed = abs(differences.mean())
+    extreme = 0
+    for start in range(0, n_resamples, 1000):
+        signs = rng.choice((-1.0, 1.0), size=(min(1000, n_resamples - start), len(differences)))
+        extreme += int((np.abs(signs @ differences) / len(differences) >= observed - 1e-12).sum())
+    return (extreme + 1) / (n_resamples + 1)
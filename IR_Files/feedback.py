@@ -0,0 +1,100 @@
+import heapq
+from collections import Counter, defaultdict
+from indexing import DynamicIndex, load_forward_vectors
+from instrumentation import count, timed
+
+# RM3 pseudo-relevance feedback
+FEEDBACK_DOCS = 10            # Top-ranked documents assumed relevant
+FEEDBACK_TERMS = 10           # Expansion terms kept from the relevance model
+ORIGINAL_QUERY_WEIGHT = 0.5   # Interpolation weight of the original query (1.0 = no expansion)
+
+
+class RM3:
+    """
+    BM25 with RM3 query expansion (relevance model interpolated with the query).
+
+    The query is ranked with bm25.top_k, the fb_docs best documents are taken as relevant
+    and their term vectors (ForwardIndex, no re-tokenizing) give the relevance model
+    P(t|R) = sum_d score(d) * tf(t,d)/|d|. Its fb_terms heaviest terms, normalised, are
+    interpolated with the normalised query term frequencies, and the weighted query is
+    ranked again with bm25.top_k (MaxScore), so expansion costs one cheap top-fb_docs
+    pass plus a few term vectors per query.
+
+    Without forward_index the vectors come from indexing.load_forward_vectors (loaded
+    once), or from the index itself if it is a DynamicIndex, which keeps the vectors of
+    added documents as they arrive. Same search/top_k/rank_documents interface as BM25,
+    but queries must be preprocessed tokens.
+    """
+
+    def __init__(self, bm25, forward_index=None, fb_docs=FEEDBACK_DOCS, fb_terms=FEEDBACK_TERMS,
+                 original_weight=ORIGINAL_QUERY_WEIGHT):
+        self.bm25 = bm25
+        self.fb_docs = fb_docs
+        self.fb_terms = fb_terms
+        self.original_weight = original_weight
+        self._forward_index = forward_index
+
+    @property
+    def N(self):
+        return self.bm25.N
+
+    @property
+    def forward_index(self):
+        """
+        Source of the feedback documents' term vectors (anything with term_vector(doc_id))
+        """
+        if self._forward_index is None:
+            index = self.bm25.inverted_index
+            self._forward_index = index if isinstance(index, DynamicIndex) else load_forward_vectors(index)
+        return self._forward_index
+
+    @timed("rm3.expand")
+    def expand(self, query_terms):
+        """
+        Expanded query as a {term: weight} dict (weights sum to 1)
+        """
+        query_counts = Counter(query_terms)
+        if not query_counts or self.original_weight >= 1:
+            return dict(query_counts)
+        index = self.bm25.inverted_index
+        forward_index = self.forward_index
+        doc_ids, doc_lengths = index.doc_ids, index.doc_lengths
+
+        relevance = defaultdict(float)  # term -> P(t|R), unnormalised
+        for doc_name, score in self.bm25.top_k(query_terms, self.fb_docs):
+            doc_id = doc_ids[doc_name]
+            if not doc_lengths[doc_id]:
+                continue
+            weight = score / doc_lengths[doc_id]
+            for term, tf in forward_index.term_vector(doc_id).items():
+                relevance[term] += weight * tf
+            count("rm3.feedback_docs")
+
+        expanded = defaultdict(float)
+        query_length = sum(query_counts.values())
+        for term, qtf in query_counts.items():
+            expanded[term] += self.original_weight * qtf / query_length
+        best = heapq.nlargest(self.fb_terms, relevance.items(), key=lambda item: item[1])
+        total = sum(weight for _, weight in best)
+        if total > 0:
+            for term, weight in best:
+                expanded[term] += (1 - self.original_weight) * weight / total
+        return dict(expanded)
+
+    def top_k(self, query_terms, k=1000):
+        return self.bm25.top_k(self.expand(query_terms), k)
+
+    def rank_documents(self, query_terms):
+        return self.bm25.rank_documents(self.expand(query_terms))
+
+    def search(self, corpus, queries, top_k=1000):
+        """
+        Search method compatible with BEIR framework; queries map query IDs to preprocessed
+        tokens (preprocessing.preprocess_text), as the index was built from them
+        """
+        results = {}
+        for query_id, query in queries.items():
+            if isinstance(query, str):
+                raise TypeError(f"Query {query_id}: RM3 expects preprocessed query tokens, not text")
+            results[query_id] = dict(self.top_k(query, top_k))
+        return results
@@ -0,0 +1,136 @@
+import numpy as np
+
+from runfile import iter_run, write_run
+
+FUSION_METHODS = ("sum", "minmax", "zscore", "rrf")
+
+
+def normalize(scores, method):
+    """
+    Normalise one run's scores for a query: "minmax" to [0, 1], "zscore" to zero mean
+    and unit variance, "sum" leaves them raw
+    """
+    if method == "minmax":
+        low, high = scores.min(), scores.max()
+        return np.ones_like(scores) if high == low else (scores - low) / (high - low)
+    if method == "zscore":
+        std = scores.std()
+        return np.zeros_like(scores) if std == 0 else (scores - scores.mean()) / std
+    return scores
+
+
+def fuse_query(ranked_lists, weights, method="minmax", depth=1000, rrf_k=60):
+    """
+    Fuse the rankings of one query from several runs.
+
+    ranked_lists holds one [(doc_id, score), ...] per run (None or [] if the run has
+    no results for the query); each is truncated to its best `depth` documents
+    before fusing. Returns [(doc_id, fused score), ...] best first.
+    """
+    doc_index = {}
+    positions, contributions = [], []
+    for ranked, weight in zip(ranked_lists, weights):
+        if not ranked:
+            continue
+        scores = np.fromiter((score for _, score in ranked), dtype=np.float64, count=len(ranked))
+        order = np.argsort(-scores, kind='stable')[:depth]
+        scores = scores[order]
+        if method == "rrf":
+            fused = weight / (rrf_k + np.arange(1, len(order) + 1))
+        else:
+            fused = weight * normalize(scores, method)
+        positions.append(np.fromiter((doc_index.setdefault(ranked[i][0], len(doc_index)) for i in order),
+                                     dtype=np.int64, count=len(order)))
+        contributions.append(fused)
+    if not doc_index:
+        return []
+    totals = np.zeros(len(doc_index))
+    np.add.at(totals, np.concatenate(positions), np.concatenate(contributions))
+    doc_ids = list(doc_index)
+    order = np.argsort(-totals, kind='stable')[:depth]
+    return [(doc_ids[i], float(totals[i])) for i in order]
+
+
+def fuse_runs(runs, weights=None, method="minmax", depth=1000, rrf_k=60):
+    """
+    Fuse N streamed runs (iterables of (query_id, ranked list)) query by query.
+
+    Runs must list their queries in the same relative order, as every run writer
+    here does, but a run may skip queries. Runs are read in lockstep and a query is
+    fused as soon as every run has produced it or provably passed it, so only a few
+    queries are buffered; runs that skipped a query do not contribute to it.
+    Raises ValueError when the runs order their queries differently: as soon as two
+    runs list a shared pair of queries in opposite orders, otherwise at the end of
+    the runs if queries are left that could not be fused.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    runs = [iter(run) for run in runs]
+    weights = list(weights) if weights is not None else [1.0 / len(runs)] * len(runs)
+    pending = [dict() for _ in runs]
+    positions = {}   # unfused query -> {run: position of the query in that run}
+    # frontier[r][s]: furthest position in run s of a query that run r has also produced.
+    # Run r has passed query X (at position p in run s) once frontier[r][s] > p.
+    frontier = [[-1] * len(runs) for _ in runs]
+    produced = [0] * len(runs)
+    order = []  # unfused query IDs in first-seen order
+    fused = set()
+    active = list(range(len(runs)))
+
+    def passed(run_number, query_id):
+        seen = positions[query_id]
+        return run_number in seen or any(frontier[run_number][s] > pos for s, pos in seen.items())
+
+    def ready(query_id):
+        # Every run has produced or passed it, and no run holds an earlier unfused query.
+        return (all(passed(r, query_id) for r in active)
+                and all(next(iter(pending[s])) == query_id for s in positions[query_id]))
+
+    def fuse(query_id):
+        fused.add(query_id)
+        del positions[query_id]
+        ranked_lists = [queued.pop(query_id, None) for queued in pending]
+        return query_id, fuse_query(ranked_lists, weights, method, depth, rrf_k)
+
+    while active:
+        for run_number in list(active):
+            item = next(runs[run_number], None)
+            if item is None:
+                active.remove(run_number)
+                continue
+            query_id, ranked = item
+            if query_id in fused:
+                raise ValueError(f"Query {query_id} arrived after it was fused: runs list queries in different orders")
+            position = produced[run_number]
+            produced[run_number] += 1
+            seen = positions.get(query_id)
+            if seen is None:
+                seen = positions[query_id] = {}
+                order.append(query_id)
+            for other, other_position in seen.items():
+                # This run already produced a query that comes after query_id in the other run.
+                if frontier[run_number][other] > other_position:
+                    raise ValueError(f"Query {query_id} is out of order in run {run_number}: "
+                                     "runs list queries in different orders")
+            seen[run_number] = position
+            for other, other_position in seen.items():
+                frontier[run_number][other] = max(frontier[run_number][other], other_position)
+                frontier[other][run_number] = max(frontier[other][run_number], position)
+            pending[run_number][query_id] = ranked
+        while True:
+            query_id = next((query_id for query_id in order if ready(query_id)), None)
+            if query_id is None:
+                break
+            order.remove(query_id)
+            yield fuse(query_id)
+    if order:
+        raise ValueError(f"Queries {order[:5]} could not be fused: runs list queries in different orders")
+
+
+def fuse_files(input_files, output_file, weights=None, method="minmax", depth=1000, rrf_k=60):
+    """
+    Stream-fuse run files (JSON or binary, see runfile) into output_file, written in the
+    format its name selects; returns the number of queries written
+    """
+    runs = [iter_run(path) for path in input_files]
+    return write_run(output_file, fuse_runs(runs, weights, method, depth, rrf_k))
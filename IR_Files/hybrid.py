@@ -0,0 +1,96 @@
+import numpy as np
+
+from dense_cache import EmbeddingStore, corpus_hash, _to_numpy
+from fusion import FUSION_METHODS, fuse_query
+
+
+class HybridSearch:
+    """
+    Hybrid retrieval in a single pass: BM25 supplies each query's top `candidates`
+    documents, only those are scored with the dense encoder, and the two signals are
+    fused in memory with fusion.fuse_query (method "sum", "minmax", "zscore" or "rrf").
+    With method=None the candidates are simply reranked by their dense score.
+
+    The dense encoder only sees the union of the candidate sets, unless the whole
+    corpus is already in the EmbeddingStore under cache_dir, in which case the
+    candidate rows are read from the cached embeddings instead.
+    """
+
+    def __init__(self, bm25, model, model_name, batch_size=128, cache_dir=None, candidates=100,
+                 weights=(0.5, 0.5), method="minmax", workers=1):
+        if method is not None and method not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method: {method}")
+        self.bm25 = bm25
+        self.model = model
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.candidates = candidates
+        self.weights = list(weights)
+        self.method = method
+        self.workers = workers
+        self._loaded = None  # [corpus, content hash, (row map, embeddings) or None] of the last corpus seen
+
+    def candidate_embeddings(self, corpus, doc_ids):
+        """
+        Embedding matrix of doc_ids (one row per ID, in order), from the cache or freshly encoded
+        """
+        if self.cache_dir is not None:
+            # Servers pass the same (unmodified) corpus with every request, so it is hashed
+            # and its cached embeddings and row map are loaded once per corpus object.
+            if self._loaded is None or self._loaded[0] is not corpus:
+                self._loaded = [corpus, corpus_hash(corpus), None]
+            if self._loaded[2] is None:
+                store = EmbeddingStore(self.cache_dir, self.model_name, self._loaded[1])
+                if store.exists():
+                    cached_ids, embeddings, _ = store.load()
+                    self._loaded[2] = ({doc_id: row for row, doc_id in enumerate(cached_ids)}, embeddings)
+            if self._loaded[2] is not None:
+                cached_rows, embeddings = self._loaded[2]
+                rows = np.fromiter((cached_rows[doc_id] for doc_id in doc_ids), dtype=np.int64, count=len(doc_ids))
+                return np.asarray(embeddings[rows], dtype=np.float32)
+        # Longest documents first, as DRES does, so batches have similar lengths.
+        order = sorted(range(len(doc_ids)), reverse=True,
+                       key=lambda i: len(corpus[doc_ids[i]].get('title', '') + corpus[doc_ids[i]].get('text', '')))
+        print(f"Encoding {len(doc_ids)} candidate documents with {self.model_name}")
+        encoded = _to_numpy(self.model.encode_corpus([corpus[doc_ids[i]] for i in order], batch_size=self.batch_size))
+        embeddings = np.empty(encoded.shape, dtype=np.float32)
+        embeddings[order] = encoded
+        return embeddings
+
+    def search(self, corpus, queries, top_k=1000, score_function="cos_sim", query_terms=None, bm25=None, **kwargs):
+        """
+        BEIR-style search: queries maps query IDs to text for the dense encoder; query_terms
+        optionally maps them to preprocessed BM25 terms (defaults to the query text), and
+        bm25 overrides the ranker the candidates come from (e.g. the server's current index)
+        """
+        if score_function not in ("cos_sim", "dot"):
+            raise ValueError(f"Unknown score function: {score_function}")
+        query_ids = list(queries)
+        bm25_queries = query_terms if query_terms is not None else queries
+        bm25_results = (self.bm25 if bm25 is None else bm25).search(corpus, {query_id: bm25_queries[query_id] for query_id in query_ids},
+                                        top_k=self.candidates, workers=self.workers)
+
+        doc_ids = sorted({doc_id for ranked in bm25_results.values() for doc_id in ranked})
+        if not doc_ids:
+            return {query_id: {} for query_id in query_ids}
+        doc_rows = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+        doc_embeddings = self.candidate_embeddings(corpus, doc_ids)
+        query_embeddings = _to_numpy(self.model.encode_queries([queries[query_id] for query_id in query_ids],
+                                                               batch_size=self.batch_size)).astype(np.float32)
+        if score_function == "cos_sim":
+            doc_embeddings /= np.maximum(np.linalg.norm(doc_embeddings, axis=1, keepdims=True), 1e-12)
+            query_embeddings /= np.maximum(np.linalg.norm(query_embeddings, axis=1, keepdims=True), 1e-12)
+
+        results = {}
+        for i, query_id in enumerate(query_ids):
+            bm25_ranked = list(bm25_results[query_id].items())
+            candidate_ids = [doc_id for doc_id, _ in bm25_ranked]
+            rows = np.fromiter((doc_rows[doc_id] for doc_id in candidate_ids), dtype=np.int64, count=len(candidate_ids))
+            dense_ranked = list(zip(candidate_ids, (doc_embeddings[rows] @ query_embeddings[i]).tolist()))
+            if self.method is None:
+                ranked = sorted(dense_ranked, key=lambda item: -item[1])[:top_k]
+            else:
+                ranked = fuse_query([bm25_ranked, dense_ranked], self.weights, self.method, depth=top_k)
+            results[query_id] = dict(ranked)
+        return results
@@ -1,6 +1,27 @@
-from collections import defaultdict
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from collections.abc import Mapping, Sequence
+from functools import cached_property
+import hashlib
+import heapq
 import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import uuid
 
+from instrumentation import count, timed
+
+def document_tokens(doc):
+    """
+    Return the index terms of a document: its preprocessed tokens if present, else its TEXT field
+    """
+    return doc['tokens'] if 'tokens' in doc else doc['TEXT']
+
+@timed("index.build_inverted_index")
 def build_inverted_index(documents):
     """
     Build an inverted index from the preprocessed documents
@@ -8,7 +29,8 @@ def build_inverted_index(documents):
     inverted_index = defaultdict(dict)
     for doc in documents: 
         doc_id = doc['DOCNO']
-        text_tokens = doc['TEXT']
+        text_tokens = document_tokens(doc)
+        count("index.tokens_indexed", len(text_tokens))
         for token in text_tokens:
             if doc_id not in inverted_index[token]:
                 inverted_index[token][doc_id] = 0
@@ -16,6 +38,530 @@ def build_inverted_index(documents):
     return inverted_index 
 
 
+class Postings:
+    """
+    Postings list of a single term: parallel sequences of integer doc IDs (ascending) and term frequencies.
+    Behaves like a read-only {doc_id: tf} dict keyed by integer doc ID.
+    """
+    __slots__ = ('doc_ids', 'tfs')
+
+    def __init__(self, doc_ids, tfs):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def _find(self, doc_id):
+        pos = bisect_left(self.doc_ids, doc_id)
+        if pos < len(self.doc_ids) and self.doc_ids[pos] == doc_id:
+            return pos
+        return -1
+
+    def __contains__(self, doc_id):
+        return self._find(doc_id) >= 0
+
+    def __getitem__(self, doc_id):
+        pos = self._find(doc_id)
+        if pos < 0:
+            raise KeyError(doc_id)
+        return self.tfs[pos]
+
+    def items(self):
+        return zip(self.doc_ids, self.tfs)
+
+    def lookup(self, doc_ids):
+        """
+        (doc_id, tf) for each of doc_ids that occurs in the postings, found by binary search
+        """
+        own_doc_ids, tfs = self.doc_ids, self.tfs
+        num_postings = len(own_doc_ids)
+        for doc_id in doc_ids:
+            pos = bisect_left(own_doc_ids, doc_id)
+            if pos < num_postings and own_doc_ids[pos] == doc_id:
+                yield doc_id, tfs[pos]
+
+
+class BaseIndex(Mapping):
+    """
+    Common interface of the integer-ID indexes: a read-only Mapping of term -> Postings
+    plus doc_names (doc ID -> DOCNO), doc_ids (DOCNO -> doc ID), doc_lengths (by doc ID)
+    and total_doc_length. version changes whenever the contents change, so that
+    rankers caching corpus statistics know when to refresh them.
+    """
+    version = 0
+
+    @property
+    def num_docs(self):
+        return len(self.doc_names)
+
+    def document_frequency(self, term):
+        postings = self.get(term)
+        return len(postings) if postings is not None else 0
+
+    def to_dict(self):
+        """
+        Expand back into the dict-of-dicts representation ({term: {DOCNO: tf}})
+        """
+        names = self.doc_names
+        return {term: {names[doc_id]: tf for doc_id, tf in postings.items()} for term, postings in self.items()}
+
+    def doc_length_map(self):
+        return dict(zip(self.doc_names, self.doc_lengths))
+
+    def changes_since(self, version):
+        """
+        (doc IDs, terms) changed after the given version, or None if they are not
+        tracked (rankers then recompute all their statistics)
+        """
+        return None
+
+    @cached_property
+    def _identity(self):
+        return uuid.uuid4().hex
+
+    @property
+    def fingerprint(self):
+        """
+        Identifies the index contents for caches of query results: it changes with version,
+        and differs between index objects unless they are opened from the same unchanged files
+        """
+        return f"{self._identity}-{self.version}"
+
+
+class CompactIndex(BaseIndex):
+    """
+    Array-backed inverted index.
+
+    Terms and documents are mapped to dense integer IDs. All postings live in two
+    contiguous arrays (doc IDs and term frequencies) ordered by term ID, with
+    offsets[t]:offsets[t + 1] delimiting the postings of term t, so the index costs
+    a few bytes per posting instead of a dict entry keyed by a string doc ID.
+
+    The index is a read-only Mapping of term -> Postings (zero-copy views), so code
+    written against the dict-of-dicts index (len(postings), `term in index`,
+    .items()) keeps working.
+    """
+
+    def __init__(self, terms, doc_names, doc_lengths, offsets, posting_doc_ids, posting_tfs):
+        self.terms = terms                      # term ID -> term
+        self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        self.doc_names = doc_names              # doc ID -> external DOCNO
+        self.doc_ids = {name: doc_id for doc_id, name in enumerate(doc_names)}
+        self.doc_lengths = doc_lengths          # array('i'), indexed by doc ID
+        self.total_doc_length = sum(doc_lengths)
+        self.offsets = offsets                  # array('q'), len(terms) + 1 entries
+        self.posting_doc_ids = posting_doc_ids  # array('i')
+        self.posting_tfs = posting_tfs          # array('i')
+
+    def __getitem__(self, term):
+        term_id = self.term_ids[term]
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return Postings(memoryview(self.posting_doc_ids)[start:end],
+                        memoryview(self.posting_tfs)[start:end])
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def document_frequency(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return 0
+        return self.offsets[term_id + 1] - self.offsets[term_id]
+
+    @classmethod
+    def from_triples(cls, terms, doc_names, doc_lengths, term_col, doc_col, tf_col):
+        """
+        Assemble an index from (term ID, doc ID, tf) columns given in ascending doc ID order
+        """
+        # Counting sort by term ID; stable, so each term's doc IDs stay ascending.
+        offsets = array('q', bytes(8 * (len(terms) + 1)))
+        for term_id in term_col:
+            offsets[term_id + 1] += 1
+        for term_id in range(len(terms)):
+            offsets[term_id + 1] += offsets[term_id]
+        positions = array('q', offsets)
+        posting_doc_ids = array('i', bytes(4 * len(term_col)))
+        posting_tfs = array('i', bytes(4 * len(term_col)))
+        for term_id, doc_id, tf in zip(term_col, doc_col, tf_col):
+            pos = positions[term_id]
+            posting_doc_ids[pos] = doc_id
+            posting_tfs[pos] = tf
+            positions[term_id] = pos + 1
+        return cls(terms, doc_names, doc_lengths, offsets, posting_doc_ids, posting_tfs)
+
+    @classmethod
+    def from_documents(cls, documents):
+        term_ids, terms = {}, []
+        doc_names, doc_lengths = [], array('i')
+        term_col, doc_col, tf_col = array('i'), array('i'), array('i')
+        for doc_id, doc in enumerate(documents):
+            tokens = document_tokens(doc)
+            doc_names.append(doc['DOCNO'])
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(terms)
+                    terms.append(term)
+                term_col.append(term_id)
+                doc_col.append(doc_id)
+                tf_col.append(tf)
+        return cls.from_triples(terms, doc_names, doc_lengths, term_col, doc_col, tf_col)
+
+    @classmethod
+    def from_inverted_index(cls, inverted_index, doc_lengths=None):
+        """
+        Convert a dict-of-dicts index ({term: {DOCNO: tf}}) into a CompactIndex
+        """
+        doc_names = list(doc_lengths or {})
+        doc_ids = {name: doc_id for doc_id, name in enumerate(doc_names)}
+        terms = []
+        offsets = array('q', [0])
+        posting_doc_ids, posting_tfs = array('i'), array('i')
+        for term, doc_tfs in inverted_index.items():
+            entries = []
+            for doc_name, tf in doc_tfs.items():
+                doc_id = doc_ids.get(doc_name)
+                if doc_id is None:
+                    doc_id = doc_ids[doc_name] = len(doc_names)
+                    doc_names.append(doc_name)
+                entries.append((doc_id, tf))
+            entries.sort()
+            terms.append(term)
+            posting_doc_ids.extend(doc_id for doc_id, _ in entries)
+            posting_tfs.extend(tf for _, tf in entries)
+            offsets.append(len(posting_doc_ids))
+        if doc_lengths is not None:
+            lengths = array('i', (doc_lengths.get(name, 0) for name in doc_names))
+        else:
+            lengths = array('i', bytes(4 * len(doc_names)))
+            for doc_id, tf in zip(posting_doc_ids, posting_tfs):
+                lengths[doc_id] += tf
+        return cls(terms, doc_names, lengths, offsets, posting_doc_ids, posting_tfs)
+
+def build_compact_index(documents):
+    """
+    Build an array-backed CompactIndex from the preprocessed documents
+    """
+    return CompactIndex.from_documents(documents)
+
+
+class ForwardIndex:
+    """
+    Per-document term vectors: the transpose of the inverted index, so the terms of a
+    few documents can be read without re-tokenizing them (used for query expansion,
+    see feedback.RM3).
+
+    Terms get their own dense IDs (terms[term_id]); the vector of doc ID d is entries
+    offsets[d]:offsets[d + 1] of term_ids and tfs. Doc IDs are those of the inverted
+    index built from the same documents.
+    """
+
+    def __init__(self, terms, offsets, term_ids, tfs):
+        self.terms = terms        # term ID -> term
+        self.offsets = offsets    # num docs + 1 entries
+        self.term_ids = term_ids
+        self.tfs = tfs
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def vector(self, doc_id):
+        """
+        (term IDs, tfs) of a document
+        """
+        start, end = self.offsets[doc_id], self.offsets[doc_id + 1]
+        return self.term_ids[start:end], self.tfs[start:end]
+
+    def term_vector(self, doc_id):
+        """
+        {term: tf} of a document
+        """
+        terms = self.terms
+        term_ids, tfs = self.vector(doc_id)
+        return {terms[term_id]: tf for term_id, tf in zip(term_ids, tfs)}
+
+    @classmethod
+    def from_documents(cls, documents):
+        term_ids, terms = {}, []
+        offsets, vector_term_ids, vector_tfs = array('q', [0]), array('i'), array('i')
+        for doc in documents:
+            for term, tf in Counter(document_tokens(doc)).items():
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(terms)
+                    terms.append(term)
+                vector_term_ids.append(term_id)
+                vector_tfs.append(tf)
+            offsets.append(len(vector_term_ids))
+        return cls(terms, offsets, vector_term_ids, vector_tfs)
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Transpose an existing index (any BaseIndex) with one pass over its postings
+        """
+        num_docs = len(index.doc_names)
+        terms = []
+        offsets = array('q', bytes(8 * (num_docs + 1)))
+        term_col, doc_col, tf_col = array('i'), array('i'), array('i')
+        for term_id, (term, postings) in enumerate(index.items()):
+            terms.append(term)
+            for doc_id, tf in postings.items():
+                term_col.append(term_id)
+                doc_col.append(doc_id)
+                tf_col.append(tf)
+                offsets[doc_id + 1] += 1
+        # Counting sort by doc ID, as in CompactIndex.from_triples
+        for doc_id in range(num_docs):
+            offsets[doc_id + 1] += offsets[doc_id]
+        positions = array('q', offsets)
+        vector_term_ids = array('i', bytes(4 * len(term_col)))
+        vector_tfs = array('i', bytes(4 * len(term_col)))
+        for term_id, doc_id, tf in zip(term_col, doc_col, tf_col):
+            pos = positions[doc_id]
+            vector_term_ids[pos] = term_id
+            vector_tfs[pos] = tf
+            positions[doc_id] = pos + 1
+        return cls(terms, offsets, vector_term_ids, vector_tfs)
+
+
+class _ChainedNames(Sequence):
+    """
+    doc ID -> DOCNO table of a base index followed by names appended since
+    """
+
+    def __init__(self, base, extra):
+        self._base = base
+        self._extra = extra
+
+    def __len__(self):
+        return len(self._base) + len(self._extra)
+
+    def __getitem__(self, doc_id):
+        if isinstance(doc_id, slice):
+            return [self[i] for i in range(*doc_id.indices(len(self)))]
+        if doc_id < 0:
+            doc_id += len(self)
+        base_size = len(self._base)
+        return self._base[doc_id] if doc_id < base_size else self._extra[doc_id - base_size]
+
+
+class DynamicIndex(BaseIndex):
+    """
+    Updatable index: an immutable base (CompactIndex or MmapIndex), an in-memory delta
+    segment holding the postings of documents added since, and a set of tombstoned
+    doc IDs. Replacing a document tombstones its old doc ID and adds it under a new one.
+
+    Postings returned by the Mapping interface contain live documents only, and
+    num_docs, total_doc_length, doc_lengths, document frequencies and the number of
+    live terms are maintained incrementally, so BM25 statistics (N, avgdl, IDF) stay
+    exact without a rebuild. An update only touches the terms of the document: their
+    merged postings are rebuilt on next access, all other terms are served straight
+    from the base, and changes_since tells rankers which documents and terms changed.
+    Deleting a document reads its terms from the base's term vectors (forward.bin,
+    or transposed from the base on the first deletion).
+    Once the pending changes exceed compaction_threshold times the base size the
+    index is compacted into a fresh CompactIndex (set the threshold to None to only
+    compact explicitly).
+    """
+
+    def __init__(self, base, compaction_threshold=0.25):
+        self.compaction_threshold = compaction_threshold
+        self.version = 0
+        self._reset(base)
+
+    def _reset(self, base):
+        self.base = base
+        self._base_num_docs = base.num_docs
+        self._added_names = []
+        self.doc_names = _ChainedNames(base.doc_names, self._added_names)
+        self.doc_ids = dict(base.doc_ids)
+        self.doc_lengths = array('i', base.doc_lengths)
+        self.total_doc_length = base.total_doc_length
+        self.deleted = set()
+        self._delta = {}  # term -> Postings of documents added since the base was built
+        self._delta_vectors = {}  # doc ID -> {term: tf} of documents added since
+        self._base_vectors = None  # ForwardIndex of the base, loaded on the first deletion
+        self._df_changes = Counter()  # term -> live document frequency minus the base's
+        self._merged = {}  # changed term -> its live Postings, or None until next accessed
+        self._num_terms = len(base)
+        self.version += 1
+        # Change log for changes_since: version after each change, and its doc ID and terms
+        self._log_start = self.version
+        self._log_versions, self._log_changes = [], []
+
+    @property
+    def num_docs(self):
+        return len(self.doc_ids)
+
+    @property
+    def pending_changes(self):
+        return len(self._added_names) + len(self.deleted)
+
+    def __getitem__(self, term):
+        if term not in self._merged:
+            return self.base[term]
+        postings = self._merged[term]
+        if postings is None:
+            postings = self._merged[term] = self._merge(term)
+        return postings
+
+    def _merge(self, term):
+        # Base postings then delta postings (higher doc IDs), without tombstoned documents
+        deleted = self.deleted
+        doc_ids, tfs = array('i'), array('i')
+        for postings in (self.base.get(term), self._delta.get(term)):
+            if postings is not None:
+                for doc_id, tf in postings.items():
+                    if doc_id not in deleted:
+                        doc_ids.append(doc_id)
+                        tfs.append(tf)
+        return Postings(doc_ids, tfs)
+
+    def __contains__(self, term):
+        return self.document_frequency(term) > 0
+
+    def __iter__(self):
+        df_changes = self._df_changes
+        for term in self.base:
+            if term not in df_changes or term in self:
+                yield term
+        for term in self._delta:
+            if term not in self.base and term in self:
+                yield term
+
+    def __len__(self):
+        return self._num_terms
+
+    def document_frequency(self, term):
+        return self.base.document_frequency(term) + self._df_changes[term]
+
+    def term_vector(self, doc_id):
+        """
+        {term: tf} of a document (as ForwardIndex.term_vector), including tombstoned ones
+        """
+        vector = self._delta_vectors.get(doc_id)
+        if vector is not None:
+            return vector
+        if self._base_vectors is None:
+            self._base_vectors = load_forward_vectors(self.base)
+        return self._base_vectors.term_vector(doc_id)
+
+    def _change_terms(self, doc_id, terms, df_change):
+        for term in terms:
+            if df_change < 0:
+                self._df_changes[term] += df_change
+                if not self.document_frequency(term):
+                    self._num_terms -= 1
+            else:
+                if not self.document_frequency(term):
+                    self._num_terms += 1
+                self._df_changes[term] += df_change
+            self._merged[term] = None
+        self.version += 1
+        self._log_versions.append(self.version)
+        self._log_changes.append((doc_id, terms))
+
+    def changes_since(self, version):
+        if version < self._log_start:
+            return None  # compacted since: doc IDs were renumbered
+        doc_ids, terms = set(), set()
+        for doc_id, doc_terms in self._log_changes[bisect_right(self._log_versions, version):]:
+            doc_ids.add(doc_id)
+            terms.update(doc_terms)
+        return doc_ids, terms
+
+    def doc_length_map(self):
+        return {name: self.doc_lengths[doc_id] for name, doc_id in self.doc_ids.items()}
+
+    def add_document(self, doc_name, tokens):
+        """
+        Index a new document; raises ValueError if doc_name is already live (use replace_document)
+        """
+        if doc_name in self.doc_ids:
+            raise ValueError(f"Document {doc_name} is already indexed; use replace_document")
+        doc_id = len(self.doc_lengths)
+        self._added_names.append(doc_name)
+        self.doc_ids[doc_name] = doc_id
+        self.doc_lengths.append(len(tokens))
+        self.total_doc_length += len(tokens)
+        vector = self._delta_vectors[doc_id] = Counter(tokens)
+        for term, tf in vector.items():
+            postings = self._delta.get(term)
+            if postings is None:
+                postings = self._delta[term] = Postings(array('i'), array('i'))
+            postings.doc_ids.append(doc_id)
+            postings.tfs.append(tf)
+        self._change_terms(doc_id, vector, 1)
+        self._maybe_compact()
+        return doc_id
+
+    def add_documents(self, documents):
+        for doc in documents:
+            self.add_document(doc['DOCNO'], document_tokens(doc))
+
+    def delete_document(self, doc_name):
+        """
+        Tombstone a document; raises KeyError if it is not indexed
+        """
+        doc_id = self.doc_ids.pop(doc_name)
+        self.deleted.add(doc_id)
+        self.total_doc_length -= self.doc_lengths[doc_id]
+        self._change_terms(doc_id, self.term_vector(doc_id), -1)
+        self._maybe_compact()
+
+    def replace_document(self, doc_name, tokens):
+        if doc_name in self.doc_ids:
+            self.delete_document(doc_name)
+        return self.add_document(doc_name, tokens)
+
+    def _maybe_compact(self):
+        if self.compaction_threshold is not None and \
+                self.pending_changes > self.compaction_threshold * max(self._base_num_docs, 1):
+            self.compact()
+
+    def compact(self):
+        """
+        Fold the delta segment and tombstones into a new CompactIndex base, renumbering live documents
+        """
+        if not self.pending_changes:
+            return self
+        live_ids = sorted(self.doc_ids.values())
+        remap = array('i', [-1]) * len(self.doc_lengths)
+        for new_id, old_id in enumerate(live_ids):
+            remap[old_id] = new_id
+        doc_names = [self.doc_names[old_id] for old_id in live_ids]
+        doc_lengths = array('i', (self.doc_lengths[old_id] for old_id in live_ids))
+        terms, offsets = [], array('q', [0])
+        posting_doc_ids, posting_tfs = array('i'), array('i')
+        for term in self:
+            postings = self[term]
+            terms.append(term)
+            # remap is increasing, so the renumbered postings stay sorted.
+            posting_doc_ids.extend(remap[doc_id] for doc_id in postings.doc_ids)
+            posting_tfs.extend(postings.tfs)
+            offsets.append(len(posting_doc_ids))
+        self._reset(CompactIndex(terms, doc_names, doc_lengths, offsets, posting_doc_ids, posting_tfs))
+        return self
+
+    def save(self, dir_path):
+        """
+        Compact and write the index in the binary format
+        """
+        self.compact()
+        save_binary_index(self.base, dir_path)
+
 
 def calculate_document_lengths(documents):
     """
@@ -24,13 +570,15 @@ def calculate_document_lengths(documents):
     doc_lengths = {}
     for doc in documents:
         doc_id = doc['DOCNO']
-        doc_lengths[doc_id] = len(doc['TEXT'])
+        doc_lengths[doc_id] = len(document_tokens(doc))
     return doc_lengths
 
 def calculate_document_frequencies(inverted_index):
     """
     Calculate document frequency for each term in the inverted index
     """
+    if isinstance(inverted_index, BaseIndex):
+        return {term: inverted_index.document_frequency(term) for term in inverted_index}
     doc_freqs = {}
     for term, postings in inverted_index.items():
         doc_freqs[term] = len(postings)
@@ -43,6 +591,8 @@ def get_corpus_size(documents):
     return len(documents)
 
 def save_inverted_index(inverted_index, doc_freqs, doc_lengths, file_path):
+    if isinstance(inverted_index, CompactIndex):
+        inverted_index = inverted_index.to_dict()
     index_data = {
         'inverted_index': inverted_index,
         'doc_freqs': doc_freqs,
@@ -56,4 +606,615 @@ def load_inverted_index(file_path):
         inverted_data = json.load(file)
     return (inverted_data['inverted_index'],
             inverted_data['doc_freqs'],
-            inverted_data['doc_lengths'])
\ No newline at end of file
+            inverted_data['doc_lengths'])
+
+
+# Binary index format (version 1). An index is a directory of three little-endian files
+# (byteswapped on big-endian hosts when written and read, see _Spool and _column):
+#   lexicon.bin   header, then term_str_offsets (u64 x T+1), postings_offsets (u64 x T+1)
+#                 and the UTF-8 term strings concatenated in sorted order
+#   postings.bin  doc IDs (i32 x P) followed by term frequencies (i32 x P)
+#   docs.bin      doc lengths (i32 x N, padded to 8 bytes), name_offsets (u64 x N+1)
+#                 and the UTF-8 DOCNOs concatenated
+# Term t's postings are entries postings_offsets[t]:postings_offsets[t + 1] of both columns.
+#
+# Version 2 (compress=True) stores the postings compressed (see compression.encode_postings):
+#   lexicon.bin   header, block size (u64), term_str_offsets, postings_offsets (still entry
+#                 counts), postings byte offsets (u64 x T+1) and the term strings
+#   postings.bin  each term's skip table and VByte blocks, starting at its byte offset
+#
+# Either version may carry per-document term vectors (forward=True, see ForwardIndex):
+#   forward.bin   forward header, vector offsets (u64 x N+1), term IDs (i32 x E) and
+#                 tfs (i32 x E) padded to 8 bytes, term_str_offsets (u64 x V+1) and the
+#                 UTF-8 terms in order of first occurrence (IDs independent of the lexicon)
+INDEX_MAGIC = b'VSMI'
+INDEX_FORMAT_VERSION = 1
+COMPRESSED_INDEX_FORMAT_VERSION = 2
+_HEADER = struct.Struct('<4sIQQQQ')  # magic, version, terms, docs, postings, total doc length
+FORWARD_MAGIC = b'VSMF'
+FORWARD_FORMAT_VERSION = 1
+_FORWARD_HEADER = struct.Struct('<4sIQQQ')  # magic, version, docs, entries, terms
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def _pad8(n):
+    return (n + 7) & ~7
+
+
+def _column(view, typecode):
+    """
+    Little-endian column of a mapped file: a zero-copy view, or a byteswapped copy on big-endian hosts
+    """
+    column = view.cast(typecode)
+    if _BIG_ENDIAN and column.itemsize > 1:
+        column = array(typecode, column)
+        column.byteswap()
+    return column
+
+
+class _Spool:
+    """
+    Append-only typed column, buffered in memory and spilled to a temporary file
+    in little-endian byte order
+    """
+
+    def __init__(self, path, typecode, buffer_size=1 << 16):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'w+b')
+        self._buffer = array(typecode)
+        self._buffer_size = buffer_size
+
+    def append(self, value):
+        self._buffer.append(value)
+        self.count += 1
+        if len(self._buffer) >= self._buffer_size:
+            self._spill()
+
+    def extend(self, values):
+        before = len(self._buffer)
+        if isinstance(values, (bytes, memoryview)) and (
+                self._buffer.typecode == 'B' or getattr(values, 'format', None) == self._buffer.typecode):
+            self._buffer.frombytes(values.cast('B') if isinstance(values, memoryview) else values)
+        else:
+            self._buffer.extend(values)
+        self.count += len(self._buffer) - before
+        if len(self._buffer) >= self._buffer_size:
+            self._spill()
+
+    def _spill(self):
+        if _BIG_ENDIAN and self._buffer.itemsize > 1:
+            self._buffer.byteswap()
+        self._buffer.tofile(self._file)
+        del self._buffer[:]
+
+    def copy_to(self, out):
+        self._spill()
+        self._file.seek(0)
+        shutil.copyfileobj(self._file, out)
+
+    def close(self):
+        self._file.close()
+        os.remove(self.path)
+
+
+class _ForwardIndexWriter:
+    """
+    Spools the term vectors of forward.bin. Only the term -> ID dictionary (the
+    vocabulary) is held in memory.
+    """
+
+    def __init__(self, spool):
+        self._offsets = spool('forward_offsets', 'Q')
+        self._term_ids = spool('forward_term_ids', 'i')
+        self._tfs = spool('forward_tfs', 'i')
+        self._term_str_offsets = spool('forward_term_str_offsets', 'Q')
+        self._terms = spool('forward_terms', 'B')
+        self._offsets.append(0)
+        self._term_str_offsets.append(0)
+        self._vocabulary = {}
+
+    def add_document(self, term_counts):
+        vocabulary = self._vocabulary
+        for term, tf in term_counts.items():
+            term_id = vocabulary.get(term)
+            if term_id is None:
+                term_id = vocabulary[term] = len(vocabulary)
+                self._terms.extend(term.encode('utf-8'))
+                self._term_str_offsets.append(self._terms.count)
+            self._term_ids.append(term_id)
+            self._tfs.append(tf)
+        self._offsets.append(self._term_ids.count)
+
+    def write(self, path):
+        num_entries = self._term_ids.count
+        with open(path, 'wb') as file:
+            file.write(_FORWARD_HEADER.pack(FORWARD_MAGIC, FORWARD_FORMAT_VERSION, self._offsets.count - 1,
+                                            num_entries, len(self._vocabulary)))
+            self._offsets.copy_to(file)
+            self._term_ids.copy_to(file)
+            self._tfs.copy_to(file)
+            file.write(bytes(_pad8(8 * num_entries) - 8 * num_entries))
+            self._term_str_offsets.copy_to(file)
+            self._terms.copy_to(file)
+        for spool in (self._offsets, self._term_ids, self._tfs, self._term_str_offsets, self._terms):
+            spool.close()
+
+
+class _BinaryIndexWriter:
+    """
+    Streams an index into dir_path in the binary format with bounded memory.
+    Documents are added in doc ID order and terms in strictly increasing UTF-8 order;
+    every column is spooled to a temporary file and the three index files are
+    assembled by close(). With compress=True postings are written in format version 2;
+    with forward=True each document's term counts (passed to add_document) are also
+    written to forward.bin.
+    """
+
+    def __init__(self, dir_path, compress=False, block_size=None, forward=False):
+        # Files are assembled in a staging directory and moved into place by close(),
+        # so an index that is currently memory-mapped can be overwritten safely.
+        self.dir_path = dir_path
+        self.staging_path = dir_path.rstrip('/\\') + '.partial'
+        os.makedirs(self.staging_path, exist_ok=True)
+
+        def spool(name, typecode):
+            return _Spool(os.path.join(self.staging_path, name + '.tmp'), typecode)
+
+        self._posting_doc_ids = spool('posting_doc_ids', 'i')
+        self._posting_tfs = spool('posting_tfs', 'i')
+        self._term_str_offsets = spool('term_str_offsets', 'Q')
+        self._postings_offsets = spool('postings_offsets', 'Q')
+        self._terms = spool('terms', 'B')
+        self._doc_lengths = spool('doc_lengths', 'i')
+        self._name_offsets = spool('name_offsets', 'Q')
+        self._names = spool('doc_names', 'B')
+        for offsets in (self._term_str_offsets, self._postings_offsets, self._name_offsets):
+            offsets.append(0)
+        self.total_doc_length = 0
+        self._last_term = None
+        self.compress = compress
+        if compress:
+            from compression import DEFAULT_BLOCK_SIZE  # numpy is only needed for compressed indexes
+            self.block_size = block_size or DEFAULT_BLOCK_SIZE
+            self._num_postings = 0
+            self._postings_bytes = spool('postings_bytes', 'B')
+            self._postings_byte_offsets = spool('postings_byte_offsets', 'Q')
+            self._postings_byte_offsets.append(0)
+        self._forward = _ForwardIndexWriter(spool) if forward else None
+
+    def add_document(self, doc_name, length, term_counts=None):
+        name = doc_name.encode('utf-8')
+        self._names.extend(name)
+        self._name_offsets.append(self._names.count)
+        self._doc_lengths.append(length)
+        self.total_doc_length += length
+        if self._forward is not None:
+            self._forward.add_document(term_counts)
+
+    def add_term(self, term_bytes, doc_ids, tfs):
+        if self._last_term is not None and term_bytes <= self._last_term:
+            raise ValueError("terms must be added in strictly increasing order")
+        self._last_term = term_bytes
+        self._terms.extend(term_bytes)
+        self._term_str_offsets.append(self._terms.count)
+        if self.compress:
+            from compression import encode_postings
+            self._postings_bytes.extend(encode_postings(doc_ids, tfs, self.block_size))
+            self._postings_bytes.extend(bytes(-self._postings_bytes.count % 4))  # keeps skip tables aligned
+            self._postings_byte_offsets.append(self._postings_bytes.count)
+            self._num_postings += len(doc_ids)
+            self._postings_offsets.append(self._num_postings)
+            return
+        self._posting_doc_ids.extend(doc_ids)
+        self._posting_tfs.extend(tfs)
+        self._postings_offsets.append(self._posting_doc_ids.count)
+
+    def close(self):
+        num_docs = self._doc_lengths.count
+        staged = lambda name: os.path.join(self.staging_path, name)
+        with open(staged('postings.bin'), 'wb') as file:
+            if self.compress:
+                self._postings_bytes.copy_to(file)
+            else:
+                self._posting_doc_ids.copy_to(file)
+                self._posting_tfs.copy_to(file)
+        with open(staged('docs.bin'), 'wb') as file:
+            self._doc_lengths.copy_to(file)
+            file.write(bytes(_pad8(4 * num_docs) - 4 * num_docs))
+            self._name_offsets.copy_to(file)
+            self._names.copy_to(file)
+        with open(staged('lexicon.bin'), 'wb') as file:
+            if self.compress:
+                file.write(_HEADER.pack(INDEX_MAGIC, COMPRESSED_INDEX_FORMAT_VERSION, self._term_str_offsets.count - 1,
+                                        num_docs, self._num_postings, self.total_doc_length))
+                file.write(struct.pack('<Q', self.block_size))
+            else:
+                file.write(_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, self._term_str_offsets.count - 1,
+                                        num_docs, self._posting_doc_ids.count, self.total_doc_length))
+            self._term_str_offsets.copy_to(file)
+            self._postings_offsets.copy_to(file)
+            if self.compress:
+                self._postings_byte_offsets.copy_to(file)
+            self._terms.copy_to(file)
+        spools = [self._posting_doc_ids, self._posting_tfs, self._term_str_offsets, self._postings_offsets,
+                  self._terms, self._doc_lengths, self._name_offsets, self._names]
+        if self.compress:
+            spools += [self._postings_bytes, self._postings_byte_offsets]
+        for spool in spools:
+            spool.close()
+        names = ['postings.bin', 'docs.bin', 'lexicon.bin']
+        if self._forward is not None:
+            self._forward.write(staged('forward.bin'))
+            names.insert(0, 'forward.bin')
+        # The lexicon carries the header, so it is moved last: a directory without
+        # a complete lexicon.bin is never mistaken for a valid index. Existing
+        # mappings of replaced files stay valid until they are released.
+        os.makedirs(self.dir_path, exist_ok=True)
+        if self._forward is None and os.path.exists(os.path.join(self.dir_path, 'forward.bin')):
+            os.remove(os.path.join(self.dir_path, 'forward.bin'))  # vectors of the index being replaced
+        for name in names:
+            os.replace(staged(name), os.path.join(self.dir_path, name))
+        os.rmdir(self.staging_path)
+
+
+def save_binary_index(index, dir_path, compress=False, forward=False):
+    """
+    Write an index (CompactIndex, or any BaseIndex) to dir_path in the binary format
+    (with compressed postings if compress is set, and term vectors if forward is set)
+    """
+    if not isinstance(index, BaseIndex):
+        raise TypeError("save_binary_index expects a CompactIndex; convert dict indexes with CompactIndex.from_inverted_index")
+    writer = _BinaryIndexWriter(dir_path, compress, forward=forward)
+    vectors = ForwardIndex.from_index(index) if forward else None
+    for doc_id, (doc_name, length) in enumerate(zip(index.doc_names, index.doc_lengths)):
+        writer.add_document(doc_name, length, vectors.term_vector(doc_id) if forward else None)
+    for term_bytes, term in sorted((term.encode('utf-8'), term) for term in index):
+        postings = index[term]
+        writer.add_term(term_bytes, postings.doc_ids, postings.tfs)
+    writer.close()
+
+
+def _map_file(path):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class _DocNames(Sequence):
+    """
+    Lazily decoded doc ID -> DOCNO table over the mapped docs.bin
+    """
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, doc_id):
+        if isinstance(doc_id, slice):
+            return [self[i] for i in range(*doc_id.indices(len(self)))]
+        return str(self._blob[self._offsets[doc_id]:self._offsets[doc_id + 1]], 'utf-8')
+
+
+class MmapIndex(BaseIndex):
+    """
+    Read-only index over the binary format, opened with mmap.
+
+    Opening only parses the fixed-size header; terms are found by binary search in
+    the sorted lexicon and postings are returned as zero-copy views of the mapped
+    postings file, so pages are read from disk only for the terms actually queried.
+    Compressed indexes return compression.CompressedPostings, decoded on access.
+    """
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        lexicon = _map_file(os.path.join(dir_path, 'lexicon.bin'))
+        if len(lexicon) < _HEADER.size:
+            raise ValueError(f"{dir_path}: truncated index header")
+        magic, version, num_terms, num_docs, num_postings, total_length = _HEADER.unpack_from(lexicon)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{dir_path}: not a binary index")
+        if version not in (INDEX_FORMAT_VERSION, COMPRESSED_INDEX_FORMAT_VERSION):
+            raise ValueError(f"{dir_path}: unsupported index format version {version}")
+        self.compressed = version == COMPRESSED_INDEX_FORMAT_VERSION
+        self.num_terms = num_terms
+        self.total_doc_length = total_length
+        # Index files are replaced (never rewritten in place) by the writer, so the header
+        # plus each file's size, inode and modification time identify the contents.
+        identity = hashlib.sha1(bytes(lexicon[:_HEADER.size]))
+        for name in ('lexicon.bin', 'postings.bin', 'docs.bin'):
+            stat = os.stat(os.path.join(dir_path, name))
+            identity.update(f"{stat.st_size}:{stat.st_ino}:{stat.st_mtime_ns}".encode('ascii'))
+        self._identity = identity.hexdigest()
+
+        pos = _HEADER.size
+        if self.compressed:
+            self.block_size, = struct.unpack_from('<Q', lexicon, pos)
+            pos += 8
+        self._term_str_offsets = _column(lexicon[pos:pos + 8 * (num_terms + 1)], 'Q')
+        pos += 8 * (num_terms + 1)
+        self._postings_offsets = _column(lexicon[pos:pos + 8 * (num_terms + 1)], 'Q')
+        pos += 8 * (num_terms + 1)
+        if self.compressed:
+            self._postings_byte_offsets = _column(lexicon[pos:pos + 8 * (num_terms + 1)], 'Q')
+            pos += 8 * (num_terms + 1)
+        self._term_blob = lexicon[pos:]
+
+        postings = _map_file(os.path.join(dir_path, 'postings.bin'))
+        if self.compressed:
+            from compression import CompressedPostings  # numpy is only needed for compressed indexes
+            self._compressed_postings = CompressedPostings
+            self._postings_blob = postings
+        else:
+            self.posting_doc_ids = _column(postings[:4 * num_postings], 'i')
+            self.posting_tfs = _column(postings[4 * num_postings:8 * num_postings], 'i')
+
+        docs = _map_file(os.path.join(dir_path, 'docs.bin'))
+        pos = _pad8(4 * num_docs)
+        self.doc_lengths = _column(docs[:4 * num_docs], 'i')
+        name_offsets = _column(docs[pos:pos + 8 * (num_docs + 1)], 'Q')
+        self.doc_names = _DocNames(name_offsets, docs[pos + 8 * (num_docs + 1):])
+
+    @cached_property
+    def doc_ids(self):
+        return {name: doc_id for doc_id, name in enumerate(self.doc_names)}
+
+    def _term_bytes(self, term_id):
+        return bytes(self._term_blob[self._term_str_offsets[term_id]:self._term_str_offsets[term_id + 1]])
+
+    def _postings(self, term_id):
+        start, end = self._postings_offsets[term_id], self._postings_offsets[term_id + 1]
+        if self.compressed:
+            data = self._postings_blob[self._postings_byte_offsets[term_id]:self._postings_byte_offsets[term_id + 1]]
+            return self._compressed_postings(data, end - start, self.block_size)
+        return Postings(self.posting_doc_ids[start:end], self.posting_tfs[start:end])
+
+    def term_id(self, term):
+        """
+        Binary search the sorted lexicon; returns -1 for unknown terms
+        """
+        key = term.encode('utf-8')
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_terms and self._term_bytes(lo) == key:
+            return lo
+        return -1
+
+    def __getitem__(self, term):
+        term_id = self.term_id(term)
+        if term_id < 0:
+            raise KeyError(term)
+        return self._postings(term_id)
+
+    def __contains__(self, term):
+        return self.term_id(term) >= 0
+
+    def __iter__(self):
+        for term_id in range(self.num_terms):
+            yield str(self._term_bytes(term_id), 'utf-8')
+
+    def __len__(self):
+        return self.num_terms
+
+    def items(self):
+        for term_id in range(self.num_terms):
+            yield str(self._term_bytes(term_id), 'utf-8'), self._postings(term_id)
+
+    def document_frequency(self, term):
+        term_id = self.term_id(term)
+        if term_id < 0:
+            return 0
+        return self._postings_offsets[term_id + 1] - self._postings_offsets[term_id]
+
+
+def load_binary_index(dir_path):
+    """
+    Open a binary index written by save_binary_index
+    """
+    if not os.path.exists(os.path.join(dir_path, 'lexicon.bin')):
+        raise FileNotFoundError(dir_path)
+    return MmapIndex(dir_path)
+
+
+def load_forward_vectors(index):
+    """
+    Term vectors of an index: the forward.bin stored with a binary index when there is
+    one, otherwise transposed from the index itself (one pass over its postings)
+    """
+    if isinstance(index, MmapIndex):
+        try:
+            return load_forward_index(index.dir_path)
+        except FileNotFoundError:
+            pass
+    return ForwardIndex.from_index(index)
+
+
+def load_forward_index(dir_path):
+    """
+    Open the term vectors stored with a binary index (built with forward=True) as a ForwardIndex
+    """
+    path = os.path.join(dir_path, 'forward.bin')
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    data = _map_file(path)
+    if len(data) < _FORWARD_HEADER.size:
+        raise ValueError(f"{path}: truncated header")
+    magic, version, num_docs, num_entries, num_terms = _FORWARD_HEADER.unpack_from(data)
+    if magic != FORWARD_MAGIC:
+        raise ValueError(f"{path}: not a forward index")
+    if version != FORWARD_FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported forward index format version {version}")
+    pos = _FORWARD_HEADER.size
+    offsets = _column(data[pos:pos + 8 * (num_docs + 1)], 'Q')
+    pos += 8 * (num_docs + 1)
+    term_ids = _column(data[pos:pos + 4 * num_entries], 'i')
+    tfs = _column(data[pos + 4 * num_entries:pos + 8 * num_entries], 'i')
+    pos += _pad8(8 * num_entries)
+    term_str_offsets = _column(data[pos:pos + 8 * (num_terms + 1)], 'Q')
+    # Same string table layout as the DOCNOs in docs.bin
+    terms = _DocNames(term_str_offsets, data[pos + 8 * (num_terms + 1):])
+    return ForwardIndex(terms, offsets, term_ids, tfs)
+
+
+# Run files written by SPIMIIndexBuilder: a sequence of records, sorted by term,
+# each a _RUN_RECORD (term byte length, postings count), the UTF-8 term, then the
+# doc IDs (i32 x n) and term frequencies (i32 x n). Runs are temporary, so the
+# columns are in native byte order.
+_RUN_RECORD = struct.Struct('<II')
+# Rough per-term cost of the in-memory dictionary (key string, dict slot, array object).
+_SPIMI_TERM_OVERHEAD = 200
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+# Upper bound on runs merged at once, to bound open files and read buffers.
+_MAX_MERGE_FAN_IN = 64
+
+
+def _read_run(path, run_number):
+    with open(path, 'rb') as file:
+        while True:
+            record = file.read(_RUN_RECORD.size)
+            if not record:
+                return
+            term_length, count = _RUN_RECORD.unpack(record)
+            term_bytes = file.read(term_length)
+            doc_ids, tfs = array('i'), array('i')
+            doc_ids.fromfile(file, count)
+            tfs.fromfile(file, count)
+            yield term_bytes, run_number, doc_ids, tfs
+
+
+def _write_run_record(file, term_bytes, doc_ids, tfs):
+    file.write(_RUN_RECORD.pack(len(term_bytes), len(doc_ids)))
+    file.write(term_bytes)
+    doc_ids.tofile(file)
+    tfs.tofile(file)
+
+
+def _merge_runs(paths):
+    """
+    k-way merge of sorted runs, yielding (term bytes, doc IDs, tfs) per distinct term.
+    Runs cover ascending doc ID ranges in path order, so a term's postings are the
+    concatenation of its records in run order.
+    """
+    runs = [_read_run(path, number) for number, path in enumerate(paths)]
+    current, doc_ids, tfs = None, array('i'), array('i')
+    for term_bytes, _, run_doc_ids, run_tfs in heapq.merge(*runs, key=lambda record: record[:2]):
+        if term_bytes != current:
+            if current is not None:
+                yield current, doc_ids, tfs
+            current, doc_ids, tfs = term_bytes, array('i'), array('i')
+        doc_ids.extend(run_doc_ids)
+        tfs.extend(run_tfs)
+    if current is not None:
+        yield current, doc_ids, tfs
+
+
+class SPIMIIndexBuilder:
+    """
+    Single-pass in-memory indexing with a memory budget.
+
+    Documents are added one at a time and receive consecutive doc IDs. Postings are
+    accumulated per term until their estimated size reaches memory_budget bytes, then
+    flushed to disk as a sorted run. finish() merges the runs straight into the binary
+    index format, so peak memory is bounded by the budget rather than the corpus size.
+    With forward=True the documents' term vectors are spooled to forward.bin as they arrive.
+    """
+
+    def __init__(self, dir_path, memory_budget=DEFAULT_MEMORY_BUDGET, compress=False, forward=False):
+        self.dir_path = dir_path
+        self.memory_budget = memory_budget
+        self.num_docs = 0
+        self.run_paths = []
+        self._writer = _BinaryIndexWriter(dir_path, compress, forward=forward)
+        self._postings = {}  # term -> array('i') of interleaved (doc ID, tf)
+        self._memory_used = 0
+
+    def add_document(self, doc_name, tokens):
+        doc_id = self.num_docs
+        self.num_docs += 1
+        term_counts = Counter(tokens)
+        self._writer.add_document(doc_name, len(tokens), term_counts)
+        postings = self._postings
+        for term, tf in term_counts.items():
+            entries = postings.get(term)
+            if entries is None:
+                entries = postings[term] = array('i')
+                self._memory_used += _SPIMI_TERM_OVERHEAD + len(term)
+            entries.append(doc_id)
+            entries.append(tf)
+            self._memory_used += 8
+        if self._memory_used >= self.memory_budget:
+            self._flush_run()
+
+    def _sorted_postings(self):
+        for term_bytes, term in sorted((term.encode('utf-8'), term) for term in self._postings):
+            entries = self._postings[term]
+            yield term_bytes, entries[0::2], entries[1::2]
+
+    def _flush_run(self):
+        path = os.path.join(self._writer.staging_path, f'run-{len(self.run_paths):05d}.tmp')
+        with open(path, 'wb') as file:
+            for term_bytes, doc_ids, tfs in self._sorted_postings():
+                _write_run_record(file, term_bytes, doc_ids, tfs)
+        self.run_paths.append(path)
+        self._postings = {}
+        self._memory_used = 0
+
+    def _merge_pass(self, run_paths):
+        """
+        Merge consecutive groups of runs into larger runs (keeps run order)
+        """
+        merged_paths = []
+        for start in range(0, len(run_paths), _MAX_MERGE_FAN_IN):
+            group = run_paths[start:start + _MAX_MERGE_FAN_IN]
+            path = os.path.join(self._writer.staging_path, f'merge-{len(merged_paths):05d}-{len(run_paths)}.tmp')
+            with open(path, 'wb') as file:
+                for term_bytes, doc_ids, tfs in _merge_runs(group):
+                    _write_run_record(file, term_bytes, doc_ids, tfs)
+            for old_path in group:
+                os.remove(old_path)
+            merged_paths.append(path)
+        return merged_paths
+
+    def finish(self):
+        """
+        Merge all runs into the final index and return it opened as an MmapIndex
+        """
+        if not self.run_paths:
+            for term_bytes, doc_ids, tfs in self._sorted_postings():
+                self._writer.add_term(term_bytes, doc_ids, tfs)
+        else:
+            if self._postings:
+                self._flush_run()
+            run_paths = self.run_paths
+            while len(run_paths) > _MAX_MERGE_FAN_IN:
+                run_paths = self._merge_pass(run_paths)
+            for term_bytes, doc_ids, tfs in _merge_runs(run_paths):
+                self._writer.add_term(term_bytes, doc_ids, tfs)
+            for path in run_paths:
+                os.remove(path)
+        self._postings = {}
+        self._writer.close()
+        return MmapIndex(self.dir_path)
+
+
+def build_index_from_stream(documents, dir_path, memory_budget=DEFAULT_MEMORY_BUDGET, compress=False,
+                            forward=False):
+    """
+    Build a binary index from an iterable of preprocessed documents without holding the corpus in memory
+    (with compressed postings if compress is set, and term vectors for load_forward_index if forward is set)
+    """
+    builder = SPIMIIndexBuilder(dir_path, memory_budget, compress, forward)
+    for doc in documents:
+        builder.add_document(doc['DOCNO'], document_tokens(doc))
+    return builder.finish()
@@ -0,0 +1,241 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Metrics are off unless IR_INSTRUMENT is set (or enable() is called): timer() then
+# returns a shared no-op context manager and count() returns immediately, so the
+# instrumented hot paths only pay for one function call and a flag test.
+_enabled = os.environ.get('IR_INSTRUMENT', '') not in ('', '0')
+# Stages named in IR_PROFILE (comma separated, or "all") run under IR_PROFILER
+# ("cprofile" or "sample"); stats files go to IR_PROFILE_DIR when set.
+_profile_stages = set(filter(None, os.environ.get('IR_PROFILE', '').split(',')))
+_profiler = os.environ.get('IR_PROFILER', 'cprofile')
+_profile_dir = os.environ.get('IR_PROFILE_DIR')
+# Set while a stage is being profiled: only one profiler can be active, so stages
+# nested inside it are timed but covered by the outer stage's profile.
+_profiling = False
+
+_timers = {}  # name -> [calls, total seconds, max seconds]
+_counters = Counter()
+_lock = threading.Lock()  # metrics are also updated from thread pools
+_NULL_TIMER = nullcontext()
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def disable():
+    enable(False)
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Clear all timers and counters, e.g. at the start of a run
+    """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def count(name, n=1):
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+
+def _record(name, elapsed):
+    with _lock:
+        entry = _timers.get(name)
+        if entry is None:
+            _timers[name] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        _record(self.name, time.perf_counter() - self.start)
+
+
+def timer(name):
+    """
+    Context manager adding the wall time of its block to the named timer
+    """
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function under the named timer
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+def configure_profiling(stages=(), profiler="cprofile", output_dir=None):
+    """
+    Profile the named stages (or "all") with "cprofile" or the "sample" stack sampler
+    """
+    global _profile_stages, _profiler, _profile_dir
+    if profiler not in ("cprofile", "sample"):
+        raise ValueError(f"Unknown profiler: {profiler}")
+    _profile_stages, _profiler, _profile_dir = set(stages), profiler, output_dir
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a background thread records the calling thread's stack every
+    `interval` seconds. Cheap enough for long stages where cProfile's per-call overhead
+    would distort timings; reports the hottest functions and collapsed stacks
+    (flamegraph.pl input).
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, limit=25):
+        total = sum(self.stacks.values())
+        self_counts, inclusive = Counter(), Counter()
+        for stack, samples in self.stacks.items():
+            frames = stack.split(';')
+            self_counts[frames[-1]] += samples
+            for frame in set(frame.rsplit(':', 1)[0] for frame in frames):
+                inclusive[frame] += samples
+        lines = [f"{total} samples every {self.interval * 1000:.1f} ms", "  self%  incl%  location"]
+        for location, samples in self_counts.most_common(limit):
+            lines.append(f"{100 * samples / max(1, total):6.1f} {100 * inclusive[location.rsplit(':', 1)[0]] / max(1, total):6.1f}  {location}")
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {samples}" for stack, samples in self.stacks.items())
+
+
+def _profile_path(name, extension):
+    os.makedirs(_profile_dir, exist_ok=True)
+    return os.path.join(_profile_dir, f"profile-{name.replace(' ', '_')}.{extension}")
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage and, if it is selected for profiling, run it under the profiler
+    (unless an enclosing stage is already profiled)
+    """
+    global _profiling
+    profile = not _profiling and (name in _profile_stages or 'all' in _profile_stages)
+    profiler = None
+    if profile and _profiler == "sample":
+        profiler = SamplingProfiler().start()
+    elif profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if profiler is not None:
+        _profiling = True
+    try:
+        with timer(f"stage.{name}"):
+            yield
+    finally:
+        if profiler is not None:
+            _profiling = False
+        if profiler is None:
+            pass
+        elif isinstance(profiler, SamplingProfiler):
+            profiler.stop()
+            print(f"\nSampling profile of stage '{name}':\n{profiler.report()}")
+            if _profile_dir:
+                with open(_profile_path(name, 'folded'), 'w', encoding='utf-8') as file:
+                    file.write(profiler.collapsed())
+        else:
+            profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(25)
+            print(f"\ncProfile of stage '{name}':\n{output.getvalue()}")
+            if _profile_dir:
+                profiler.dump_stats(_profile_path(name, 'prof'))
+
+
+def snapshot():
+    """
+    Current metrics as {"timers": {name: {...}}, "counters": {name: value}}
+    """
+    with _lock:
+        timers = {name: {"calls": calls, "total_seconds": total, "mean_ms": 1000 * total / calls, "max_ms": 1000 * longest}
+                  for name, (calls, total, longest) in sorted(_timers.items())}
+        return {"timers": timers, "counters": dict(sorted(_counters.items()))}
+
+
+def summary():
+    """
+    Text table of all timers and counters
+    """
+    metrics = snapshot()
+    lines = [f"{'timer':40} {'calls':>9} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+    for name, stats in metrics["timers"].items():
+        lines.append(f"{name:40} {stats['calls']:9d} {stats['total_seconds']:10.3f} {stats['mean_ms']:10.3f} {stats['max_ms']:10.3f}")
+    lines.append(f"{'counter':40} {'value':>9}")
+    for name, value in metrics["counters"].items():
+        lines.append(f"{name:40} {value:9d}")
+    return '\n'.join(lines)
+
+
+def export_json(output_file):
+    with open(output_file, 'w', encoding='utf-8') as file:
+        json.dump(snapshot(), file, indent=4)
@@ -1,47 +1,52 @@
+import argparse
 import time
 from parser import *
 from preprocessing import *
 from indexing import *
 from ranking import *
-from beir_ranking import rank_documents
+from beir_ranking import MODEL_LOADERS  # Cheap: model backends are imported only when a model is loaded
 from utils import *
+import instrumentation
 import os
 
 dataset = "scifact"  # SciFact dataset for Assignment 1
 doc_folder_path = dataset + '/corpus.jsonl'
 query_file_path = dataset + '/queries.jsonl'
 stopwords_path = 'List of Stopwords.html'
-index_file_path = 'inverted_index.json'
-preprocessed_docs_path = 'preprocessed_documents.json'
+index_dir_path = 'inverted_index'  # binary, memory-mapped index directory
 preprocessed_queries_path = 'preprocessed_queries.json'
 
+# Set IR_INSTRUMENT=1 to print timers and counters at the end of the run (also saved to this file),
+# and IR_PROFILE=index,rank (with IR_PROFILER=cprofile or sample) to profile those stages
+instrumentation_path = 'instrumentation.json'
+
 # Preprocessing settings
 USE_STEMMING = True  # Set to True to enable Porter stemming
-
-start_time = time.time()
-
-# Load stopwords
-print("Loading stopwords")
-stopwords = load_stopwords(stopwords_path)
-print(f"Loaded {len(stopwords)} stopwords")
-
-print("Parsing documents")
-documents = []
-
-# Preprocess documents and queries
-if os.path.exists(preprocessed_docs_path):
-    print("Loading preprocessed documents")
-    documents = load_preprocessed_data(preprocessed_docs_path)
-else:
-    print("Preprocessing documents")
-    documents = parse_documents_from_file(doc_folder_path)
-    documents = preprocess_documents(documents, stopwords, stem=USE_STEMMING)
-    save_preprocessed_data(documents, preprocessed_docs_path)
-
-if os.path.exists(preprocessed_queries_path):
-    print("Loading preprocessed queries")
-    queries = load_preprocessed_data(preprocessed_queries_path)
-else:
+PREPROCESS_WORKERS = 1  # Set > 1 to preprocess the corpus with a process pool
+INDEX_MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes of postings held in memory while indexing
+INDEX_COMPRESSION = False  # Set to True to store postings delta + VByte compressed (smaller, slower to traverse)
+INDEX_FORWARD = True  # Also store per-document term vectors (forward.bin), read by RM3 query expansion
+
+# Default model; other options:
+#   --model-type bm25                                                (lexical baseline, no model backends loaded)
+#   --model-type bm25-rm3                                            (BM25 with RM3 query expansion, see feedback.py)
+#   --model-name BeIR/sparta-msmarco-distilbert-base-v1 --model-type sparta
+#   --model-name https://tfhub.dev/google/universal-sentence-encoder-qa/3 --model-type use-qa
+#   --model-name dpr --model-type dpr
+#   --model-name msmarco-roberta-base-ance-firstp --model-type ance
+#   --model-name msmarco-distilbert-base-v3 --model-type hybrid     (see HYBRID_* settings in beir_ranking.py)
+MODEL_NAME = "msmarco-distilbert-base-v3"
+MODEL_TYPE = "sentence-bert"
+RESULTS_FILE = "Results.json"   # Results.txt for TREC formatting or Results.run for the binary run format
+
+
+def load_queries(stopwords):
+    """
+    Load the preprocessed test queries, preprocessing and caching them on the first run
+    """
+    if os.path.exists(preprocessed_queries_path):
+        print("Loading preprocessed queries")
+        return load_preprocessed_data(preprocessed_queries_path)
     print("Preprocessing queries")
     # Parse all queries first
     all_queries = parse_queries_from_file(query_file_path)
@@ -50,53 +55,77 @@ else:
     print(f"Filtered to {len(queries)} test queries (odd IDs only)")
     queries = preprocess_queries(queries, stopwords, stem=USE_STEMMING)
     save_preprocessed_data(queries, preprocessed_queries_path)
-
-start_time = time.time()
-
-# Build or load inverted index
-try:
-    inverted_index = load_inverted_index(index_file_path)
-    print("Inverted index loaded successfully.")
-except FileNotFoundError:
-    print("Inverted index not found, building a new one.")
-    inverted_index = build_inverted_index(documents)
-    save_inverted_index(inverted_index, index_file_path)
-    end_time = time.time()
-    print(f"Time taken to build inverted index: {end_time - start_time:.2f} seconds")
-
-doc_frequency = {word: len(docs) for word, docs in inverted_index.items()}
-sorted_words = sorted(doc_frequency.items(), key=lambda item: item[1], reverse=True)
-#print("Sample of Most Frequent Tokens: " + str(sorted_words[:20]))
-
-doc_lengths = calculate_document_lengths(documents)
-
-results_file = "Results.json"   #Change to Results.txt for TREC formatting
-start_time = time.time()
-beir_results = {}
-
-print("Ranking and writing to results file")
-start_time = time.time()
-#bm25 = BM25(inverted_index, doc_lengths)    #Uncomment these 2 lines
-#writeResults(results_file, queries, bm25)   #To use the baseline BM25
-
-#model_name = "BeIR/sparta-msmarco-distilbert-base-v1"
-#model_type = "sparta"
-
-model_name = "msmarco-distilbert-base-v3"
-model_type = "sentence-bert"
-
-#model_name = "https://tfhub.dev/google/universal-sentence-encoder-qa/3"
-#model_type = "use-qa"
-
-#model_name = "dpr"
-#model_type = "dpr"
-
-#model_name = "msmarco-roberta-base-ance-firstp"
-#model_type = "ance"
-
-results = rank_documents(documents, queries, model_name=model_name, model_type=model_type, rerank=False)  # Set rerank=True for Cross-Encoder models
-end_time = time.time()
-save_results(results, results_file)
-print(f"\nTime taken to rank documents: {end_time - start_time:.2f} seconds")
-
-print(f"Ranking results written to {results_file}")
+    return queries
+
+
+def load_index(stopwords):
+    """
+    Load the binary inverted index, building it from the corpus if it does not exist yet
+    """
+    try:
+        inverted_index = load_binary_index(index_dir_path)
+        print("Inverted index loaded successfully.")
+    except FileNotFoundError:
+        print("Inverted index not found, building a new one.")
+        start_time = time.time()
+        # Streaming pipeline: parse line -> preprocess -> SPIMI index builder
+        document_stream = iter_preprocessed_documents(iter_documents_from_file(doc_folder_path), stopwords,
+                                                      stem=USE_STEMMING, workers=PREPROCESS_WORKERS)
+        with instrumentation.stage("index"):
+            inverted_index = build_index_from_stream(document_stream, index_dir_path, memory_budget=INDEX_MEMORY_BUDGET,
+                                                     compress=INDEX_COMPRESSION, forward=INDEX_FORWARD)
+        print(f"Time taken to build inverted index: {time.time() - start_time:.2f} seconds")
+    return inverted_index
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Rank the SciFact test queries and write a results file")
+    arg_parser.add_argument('--model-type', default=MODEL_TYPE, choices=sorted(set(MODEL_LOADERS) - {"cross-encoder"}))
+    arg_parser.add_argument('--model-name', default=MODEL_NAME)
+    arg_parser.add_argument('--rerank', action='store_true', help="rerank the results with a cross-encoder")
+    arg_parser.add_argument('--batch', action='store_true', help="bm25: score all queries with one sparse matrix product")
+    arg_parser.add_argument('--results', default=RESULTS_FILE)
+    args = arg_parser.parse_args(argv)
+    if args.batch and args.model_type == "bm25-rm3":
+        arg_parser.error("--batch is not supported with query expansion (bm25-rm3)")
+
+    # Load stopwords
+    print("Loading stopwords")
+    stopwords = load_stopwords(stopwords_path)
+    print(f"Loaded {len(stopwords)} stopwords")
+    queries = load_queries(stopwords)
+    inverted_index = load_index(stopwords)
+
+    #doc_freqs = calculate_document_frequencies(inverted_index)
+    #sorted_words = sorted(doc_freqs.items(), key=lambda item: item[1], reverse=True)
+    #print("Sample of Most Frequent Tokens: " + str(sorted_words[:20]))
+
+    print("Ranking and writing to results file")
+    start_time = time.time()
+    if args.model_type in ("bm25", "bm25-rm3") and not args.rerank:
+        # BM25 straight from the index: the corpus text is not needed
+        ranker = BM25(inverted_index)
+        if args.model_type == "bm25-rm3":
+            from feedback import RM3
+            ranker = RM3(ranker)
+        with instrumentation.stage("rank"):
+            writeResults(args.results, queries, ranker, batch=args.batch)
+    else:
+        from beir_ranking import rank_documents
+        # Dense models and the reranker need the raw document text
+        print("Parsing documents")
+        documents = parse_documents_from_file(doc_folder_path)
+        with instrumentation.stage("rank"):
+            results = rank_documents(documents, queries, model_name=args.model_name, model_type=args.model_type,
+                                     rerank=args.rerank, inverted_index=inverted_index)
+        save_results(results, args.results)
+    print(f"\nTime taken to rank documents: {time.time() - start_time:.2f} seconds")
+    print(f"Ranking results written to {args.results}")
+
+    if instrumentation.enabled():
+        print(instrumentation.summary())
+        instrumentation.export_json(instrumentation_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,15 @@ def parse_documents_from_file(file_path):
         parsed_docs = [parse_document(line) for line in file]
     return parsed_docs
 
+def iter_documents_from_file(file_path):
+    """
+    Lazily parse the JSON lines file, yielding one document at a time
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield parse_document(line)
+
 def parse_query(query_line):
     """
     Parse a single JSON line as a query
@@ -0,0 +1,304 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from parser import iter_documents_from_file, parse_document, parse_queries_from_file
+from preprocessing import configure_stem_cache, load_stopwords, preprocess_documents, preprocess_queries
+from indexing import build_index_from_stream, load_binary_index, DEFAULT_MEMORY_BUDGET
+from ranking import BM25
+
+PERCENTILES = (50, 95, 99)
+
+# Importing the lexical pipeline (main and what a BM25 run uses) must stay cheap: none of these
+# may be loaded and the imports must finish within the budget (see check_startup).
+HEAVY_MODULES = ("beir", "tensorflow", "torch", "sentence_transformers", "transformers", "nltk", "numpy", "scipy")
+STARTUP_MODULES = ("main", "beir_ranking", "ranking", "indexing", "preprocessing", "runfile", "utils")
+STARTUP_BUDGET_SECONDS = 0.5
+
+
+def _read_status(field):
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    # Linux resets VmHWM (peak RSS) to the current RSS when "5" is written to clear_refs.
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes (since the last reset, where supported)
+    """
+    peak = _read_status('VmHWM')
+    if peak is None:
+        scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KiB elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return peak
+
+
+class StageRecorder:
+    """
+    Records wall time and peak RSS of named pipeline stages. Peak RSS is per stage
+    where the kernel allows resetting the high-water mark, otherwise it is the peak so far;
+    worker processes are reported separately as the peak of any child.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        resettable = _reset_peak_rss()
+        start_rss = _read_status('VmRSS')
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+            self.stages[name] = {"seconds": elapsed, "peak_rss_bytes": peak_rss(), "start_rss_bytes": start_rss,
+                                 "peak_is_per_stage": resettable, "children_peak_rss_bytes": children}
+            print(f"[{name}] {elapsed:.3f}s, peak RSS {peak_rss() / 2 ** 20:.1f} MiB")
+
+
+def latency_summary(latencies):
+    """
+    p50/p95/p99/mean/max latency in milliseconds and queries per second of per-query timings
+    """
+    if not latencies:
+        return {"queries": 0}
+    ordered = sorted(latencies)
+    summary = {"queries": len(ordered), "qps": len(ordered) / sum(ordered) if sum(ordered) > 0 else float('inf'),
+               "mean_ms": 1000 * sum(ordered) / len(ordered), "max_ms": 1000 * ordered[-1]}
+    for p in PERCENTILES:
+        # Nearest-rank percentile
+        summary[f"p{p}_ms"] = 1000 * ordered[max(0, -(-p * len(ordered) // 100) - 1)]
+    return summary
+
+
+def write_scaled_corpus(source_path, output_path, scale, seed=0):
+    """
+    Write a corpus scale times the size of source_path: copy 0 is the original and
+    copy i > 0 re-issues every document as "<id>-<i>" with its title and text words
+    shuffled by a seeded RNG, so vocabulary and document lengths keep their distribution
+    """
+    rng = random.Random(seed)
+    with open(output_path, 'w', encoding='utf-8') as output:
+        for copy in range(scale):
+            with open(source_path, 'r', encoding='utf-8') as source:
+                for line in source:
+                    if not line.strip():
+                        continue
+                    if copy == 0:
+                        output.write(line.rstrip('\n') + '\n')
+                        continue
+                    doc = json.loads(line)
+                    doc['_id'] = f"{doc['_id']}-{copy}"
+                    for field in ('title', 'text'):
+                        words = doc.get(field, '').split()
+                        rng.shuffle(words)
+                        doc[field] = ' '.join(words)
+                    output.write(json.dumps(doc) + '\n')
+    return output_path
+
+
+def benchmark_bm25(index, queries, top_k=1000, batch=True):
+    """
+    Per-query latency of BM25.top_k and, optionally, the throughput of BM25.search_batch
+    """
+    bm25 = BM25(index)
+    query_terms = {query['num']: query['tokens'] for query in queries}
+    latencies = []
+    for terms in query_terms.values():
+        start_time = time.perf_counter()
+        bm25.top_k(terms, top_k)
+        latencies.append(time.perf_counter() - start_time)
+    results = {"bm25": latency_summary(latencies)}
+    if batch:
+        try:
+            bm25.search_batch(query_terms, top_k)  # compiles the matrix
+            start_time = time.perf_counter()
+            bm25.search_batch(query_terms, top_k)
+            elapsed = time.perf_counter() - start_time
+            results["bm25-batch"] = {"queries": len(query_terms), "qps": len(query_terms) / elapsed if elapsed else float('inf'),
+                                     "total_seconds": elapsed}
+        except ImportError as error:
+            results["bm25-batch"] = {"skipped": str(error)}
+    return results
+
+
+def benchmark_model(model_name, model_type, corpus_path, queries, recorder, top_k=1000, index=None):
+    """
+    Per-query latency of a beir_ranking model type over index (needed by the lexical and
+    hybrid types); corpus encoding (first search) is a separate stage
+    """
+    from beir_ranking import HYBRID_DENSE_TYPE, load_model, _text  # beir and the model backends are only needed here
+
+    if model_type == "cross-encoder":
+        raise ValueError("cross-encoder is a reranker, not a search model")
+    corpus = {}
+    for doc in iter_documents_from_file(corpus_path):
+        corpus[doc['DOCNO']] = {"title": _text(doc['HEAD']), "text": _text(doc['TEXT'])}
+    model = load_model(model_name, model_type, corpus, index)
+    query_dict = {query['num']: _text(query['title'], query['query'], query['narrative']) for query in queries}
+    query_terms = {query['num']: query['tokens'] for query in queries}
+    dense_type = HYBRID_DENSE_TYPE if model_type == "hybrid" else model_type
+    score_function = "dot" if dense_type == "ance" else "cos_sim"
+
+    def search(query_id):
+        if model_type in ("bm25", "bm25-rm3"):
+            return model.search(corpus, {query_id: query_terms[query_id]}, top_k)
+        if model_type == "hybrid":
+            return model.search(corpus, {query_id: query_dict[query_id]}, top_k, score_function,
+                                query_terms={query_id: query_terms[query_id]})
+        return model.search(corpus, {query_id: query_dict[query_id]}, top_k, score_function)
+
+    with recorder.stage(f"{model_type}: encode corpus"):
+        search(next(iter(query_dict)))
+    latencies = []
+    for query_id in query_dict:
+        start_time = time.perf_counter()
+        search(query_id)
+        latencies.append(time.perf_counter() - start_time)
+    return latency_summary(latencies)
+
+
+def run_scale(dataset, scale, stopwords, queries, work_dir, models=(), workers=1, memory_budget=DEFAULT_MEMORY_BUDGET,
+              top_k=1000):
+    """
+    Run every pipeline stage on the corpus scaled by `scale`; returns the scale's JSON record
+    """
+    corpus_path = os.path.join(dataset, 'corpus.jsonl')
+    if scale != 1:
+        corpus_path = write_scaled_corpus(corpus_path, os.path.join(work_dir, f'corpus-x{scale}.jsonl'), scale)
+    index_dir = os.path.join(work_dir, f'index-x{scale}')
+    configure_stem_cache()  # every scale starts with a cold stem cache
+    recorder = StageRecorder()
+
+    with recorder.stage("parse"):
+        with open(corpus_path, 'r', encoding='utf-8') as file:
+            documents = [parse_document(line) for line in file if line.strip()]
+    with recorder.stage("preprocess"):
+        preprocess_documents(documents, stopwords, stem=True, workers=workers, verbose=True)
+    with recorder.stage("index build"):
+        build_index_from_stream(iter(documents), index_dir, memory_budget=memory_budget)
+    num_docs = len(documents)
+    del documents
+    with recorder.stage("index load"):
+        index = load_binary_index(index_dir)
+    with recorder.stage("query"):
+        query_results = benchmark_bm25(index, queries, top_k)
+    for model_name, model_type in models:
+        query_results[model_type] = benchmark_model(model_name, model_type, corpus_path, queries, recorder, top_k,
+                                                    index)
+    return {"scale": scale, "num_docs": num_docs, "index_bytes": _dir_size(index_dir),
+            "stages": recorder.stages, "queries": query_results}
+
+
+def startup_footprint(modules=STARTUP_MODULES):
+    """
+    Import modules in a fresh interpreter: seconds taken, peak RSS in bytes and the HEAVY_MODULES it loaded
+    """
+    script = ("import json, sys, time\n"
+              "start_time = time.perf_counter()\n"
+              f"for name in {list(modules)!r}: __import__(name)\n"
+              "seconds = time.perf_counter() - start_time\n"
+              "from perf_benchmark import HEAVY_MODULES, peak_rss\n"
+              "loaded = sorted(name for name in HEAVY_MODULES if name in sys.modules)\n"
+              "print(json.dumps({'seconds': seconds, 'peak_rss_bytes': peak_rss(), 'heavy_modules': loaded}))")
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check_startup(budget=STARTUP_BUDGET_SECONDS):
+    """
+    Import-time regression check: return a list of problems (empty if startup is still lean)
+    """
+    footprint = startup_footprint()
+    print(f"Startup imports: {footprint['seconds']:.3f}s, peak RSS {footprint['peak_rss_bytes'] / 2 ** 20:.1f} MiB")
+    problems = [f"{name} is imported at startup" for name in footprint['heavy_modules']]
+    if footprint['seconds'] > budget:
+        problems.append(f"startup imports took {footprint['seconds']:.3f}s (budget {budget}s)")
+    return problems
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(dataset="scifact", scales=(1,), models=(), workers=1, num_queries=None, top_k=1000,
+                   stopwords_path='List of Stopwords.html', output_file='perf_results.json'):
+    """
+    Benchmark the pipeline at each scale and write a JSON report to output_file
+    """
+    stopwords = load_stopwords(stopwords_path)
+    queries = parse_queries_from_file(os.path.join(dataset, 'queries.jsonl'))
+    queries = [query for query in queries if int(query['num']) % 2 == 1][:num_queries]  # test queries, as in main.py
+    preprocess_queries(queries, stopwords, stem=True)
+    report = {"commit": _git_commit(), "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+              "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+              "dataset": dataset, "top_k": top_k, "startup": startup_footprint(), "results": []}
+    work_dir = tempfile.mkdtemp(prefix='perf-')
+    try:
+        for scale in scales:
+            print(f"Benchmarking {dataset} x{scale}")
+            report["results"].append(run_scale(dataset, scale, stopwords, queries, work_dir, models, workers,
+                                               top_k=top_k))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    with open(output_file, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    print(f"Benchmark results written to {output_file}")
+    return report
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Latency, throughput and memory benchmarks of the IR pipeline")
+    arg_parser.add_argument('--dataset', default='scifact')
+    arg_parser.add_argument('--scales', type=int, nargs='+', default=[1], help="corpus scale factors, e.g. 1 10 100")
+    arg_parser.add_argument('--model', nargs=2, action='append', default=[], metavar=('NAME', 'TYPE'),
+                            help="also benchmark a beir_ranking model, e.g. --model msmarco-distilbert-base-v3 sentence-bert")
+    arg_parser.add_argument('--workers', type=int, default=1, help="preprocessing worker processes")
+    arg_parser.add_argument('--queries', type=int, default=None, help="limit the number of queries")
+    arg_parser.add_argument('--top-k', type=int, default=1000)
+    arg_parser.add_argument('--output', default='perf_results.json')
+    arg_parser.add_argument('--check-startup', action='store_true',
+                            help="only run the import-time regression check; exits with status 1 on failure")
+    args = arg_parser.parse_args()
+    if args.check_startup:
+        problems = check_startup()
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        sys.exit(1 if problems else 0)
+    run_benchmarks(args.dataset, args.scales, [tuple(model) for model in args.model], args.workers, args.queries,
+                   args.top_k, output_file=args.output)
@@ -1,58 +1,307 @@
 import math
 import datetime
+import heapq
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from array import array
+from collections import Counter, defaultdict
+from indexing import BaseIndex, CompactIndex
+from instrumentation import count, timed
+from result_cache import cache_key
+
+# After incremental index updates (see BaseIndex.changes_since) only the changed documents'
+# length normalisation is recomputed while avgdl is unchanged; otherwise all documents are
+# renormalised (O(N)). BM25(avgdl_tolerance=...) trades exactness for cheaper updates by
+# keeping the avgdl of the last full refresh until the true avgdl drifts by more than
+# that fraction of it: scores are then approximate and depend on the update history.
+AVGDL_REFRESH_TOLERANCE = 0.0
 
 class BM25:
-    def __init__(self, inverted_index, doc_lengths, k1=1.5, b=0.75, avgdl=None):
+    def __init__(self, inverted_index, doc_lengths=None, k1=1.5, b=0.75, avgdl=None, result_cache=None,
+                 avgdl_tolerance=AVGDL_REFRESH_TOLERANCE):
+        # Dict-of-dicts indexes are converted once; CompactIndex/MmapIndex carry their own doc lengths.
+        if not isinstance(inverted_index, BaseIndex):
+            inverted_index = CompactIndex.from_inverted_index(inverted_index, doc_lengths)
         self.inverted_index = inverted_index
-        self.doc_lengths = doc_lengths
         self.k1 = k1
         self.b = b
-        self.avgdl = avgdl if avgdl is not None else sum(doc_lengths.values()) / len(doc_lengths)
-        self.N = len(doc_lengths)  # Total number of documents
+        self._fixed_avgdl = avgdl
+        self.result_cache = result_cache  # optional result_cache.ResultCache for rank_documents/top_k
+        self.avgdl_tolerance = avgdl_tolerance  # > 0: approximate scores after updates (see above)
+        self._index_version = None
+        self._update_statistics()
 
-    def idf(self, term):
-        df = len(self.inverted_index.get(term, {}))
+    def _update_statistics(self):
+        """
+        (Re)compute everything that does not depend on the query. Called at construction
+        and again whenever the index version changes (incremental updates).
+        """
+        index = self.inverted_index
+        changes = index.changes_since(self._index_version) if self._index_version is not None else None
+        self._index_version = index.version
+        self.doc_lengths = index.doc_lengths  # indexed by integer doc ID
+        self.N = index.num_docs  # Total number of (live) documents
+        avgdl = self._fixed_avgdl if self._fixed_avgdl is not None else index.total_doc_length / self.N
+
+        # The length normalisation k1*(1-b+b*dl/avgdl) of every document is computed
+        # here, and each term's IDF the first time the term is queried (so opening a
+        # memory-mapped index does not walk its whole lexicon). Scoring only touches
+        # the postings of query terms.
+        self.idfs = {}
+        self._matrix = None
+        if changes is not None and abs(avgdl - self.avgdl) <= self.avgdl_tolerance * self.avgdl:
+            # Incremental update: self.avgdl stays the one the norms were computed with
+            # (exact unless avgdl_tolerance > 0)
+            doc_ids, terms = changes
+            doc_norms = self.doc_norms
+            doc_norms.extend(repeat(0.0, len(self.doc_lengths) - len(doc_norms)))
+            for doc_id in doc_ids:
+                doc_norms[doc_id] = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avgdl)
+            for term in terms:
+                self.max_tf_weights.pop(term, None)
+            return
+        self.avgdl = avgdl
+        self.max_tf_weights = {}
+        self.doc_norms = array('d', (
+            self.k1 * (1 - self.b + self.b * length / self.avgdl)
+            for length in self.doc_lengths
+        ))
+
+    def _idf(self, df):
         return math.log((self.N - df + 0.5) / (df + 0.5) + 1)
 
+    def idf(self, term):
+        idf_value = self.idfs.get(term)
+        if idf_value is None:
+            idf_value = self.idfs[term] = self._idf(self.inverted_index.document_frequency(term))
+        return idf_value
+
+    def max_tf_weight(self, term, postings):
+        """
+        Largest tf/(tf + norm) over the postings of a term; idf*(k1+1) times this
+        bounds the term's contribution to any document score. Computed on first use.
+        """
+        value = self.max_tf_weights.get(term)
+        if value is None:
+            doc_norms = self.doc_norms
+            value = self.max_tf_weights[term] = max(
+                (tf / (tf + doc_norms[doc_id]) for doc_id, tf in postings.items()), default=0.0)
+        return value
+
+    def _query_plan(self, query_terms):
+        """
+        Return (weight, upper bound, postings) per distinct matching query term, ordered
+        by decreasing upper bound. Both ranking paths add term contributions in this
+        order, so they produce bit-identical scores.
+
+        query_terms is a list of terms (weighted by their query frequency) or a
+        {term: weight} dict, e.g. an expanded query (see feedback.RM3).
+        """
+        if self.inverted_index.version != self._index_version:
+            self._update_statistics()
+        k1_plus_1 = self.k1 + 1
+        plan = []
+        query_weights = query_terms if isinstance(query_terms, dict) else Counter(query_terms)
+        for term, qtf in query_weights.items():
+            postings = self.inverted_index.get(term)
+            if not postings:
+                continue
+            weight = qtf * self.idf(term) * k1_plus_1
+            plan.append((weight, weight * self.max_tf_weight(term, postings), postings))
+        plan.sort(key=lambda entry: entry[1], reverse=True)
+        return plan
+
     def bm25_score(self, doc_id, query_terms):
         """
         Calculate the BM25 score for a single document and a given query
         """
+        if self.inverted_index.version != self._index_version:
+            self._update_statistics()
         score = 0.0
-        doc_length = self.doc_lengths[doc_id]
-        for term in query_terms:
-            if term in self.inverted_index and doc_id in self.inverted_index[term]:
-                tf = self.inverted_index[term][doc_id]
-                idf_value = self.idf(term)
-                term_score = idf_value * (tf * (self.k1 + 1)) / (tf + self.k1 * (1 - self.b + self.b * doc_length / self.avgdl))
-                score += term_score
+        doc_id = self.inverted_index.doc_ids[doc_id]
+        doc_norm = self.doc_norms[doc_id]
+        query_weights = query_terms.items() if isinstance(query_terms, dict) else zip(query_terms, repeat(1))
+        for term, qtf in query_weights:
+            postings = self.inverted_index.get(term)
+            if postings is not None and doc_id in postings:
+                tf = postings[doc_id]
+                score += qtf * self.idf(term) * (tf * (self.k1 + 1)) / (tf + doc_norm)
         return score
     
-    def search(self, corpus, queries, top_k=1000):
+    def search(self, corpus, queries, top_k=1000, workers=1, executor="process"):
         """
         Search method compatible with BEIR framework
+
+        With workers > 1 the queries are split into chunks scored by a pool of
+        worker processes (executor="process") or threads (executor="thread").
+        Worker processes are forked after this ranker is published in a module
+        global, so they share the index pages instead of receiving a copy; where
+        fork is unavailable, threads are used. Results keep the order of queries.
+        """
+        items = [(query_id, query.split() if isinstance(query, str) else query)
+                 for query_id, query in queries.items()]
+        if workers <= 1 or len(items) <= 1:
+            return {query_id: dict(self.top_k(query_terms, top_k)) for query_id, query_terms in items}
+        if executor not in ("process", "thread"):
+            raise ValueError(f"Unknown executor: {executor}")
+
+        # Refresh statistics up front so workers never recompute them.
+        if self.inverted_index.version != self._index_version:
+            self._update_statistics()
+        chunk_size = max(1, -(-len(items) // (4 * workers)))
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+        global _shared_ranker
+        if executor == "process" and "fork" in multiprocessing.get_all_start_methods():
+            _shared_ranker = self
+            try:
+                with ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context("fork")) as pool:
+                    chunk_results = list(pool.map(_search_chunk, chunks, repeat(top_k)))
+            finally:
+                _shared_ranker = None
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                chunk_results = list(pool.map(self._search_chunk, chunks, repeat(top_k)))
+        return {query_id: dict(ranked) for chunk in chunk_results for query_id, ranked in chunk}
+
+    def _search_chunk(self, chunk, top_k):
+        return [(query_id, self.top_k(query_terms, top_k)) for query_id, query_terms in chunk]
+
+    @timed("bm25.search_batch")
+    def search_batch(self, queries, top_k=1000, batch_size=256):
+        """
+        Score all queries at once with a sparse matrix product (see batch_ranking.BM25Matrix).
+        Same input and output format as search; the matrix is compiled on first use.
+        """
+        if self.inverted_index.version != self._index_version:
+            self._update_statistics()
+        if self._matrix is None:
+            from batch_ranking import BM25Matrix  # numpy/scipy are only needed for batch mode
+            self._matrix = BM25Matrix(self)
+        return self._matrix.search(queries, top_k, batch_size)
+
+    def _ranked(self, scores):
+        # Ties are broken by internal doc ID so that exhaustive and top-k rankings agree.
+        doc_names = self.inverted_index.doc_names
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(doc_names[doc_id], score) for doc_id, score in ranked]
+
+    def _cached(self, method, query_terms, k):
         """
-        results = {}
-        for query_id, query in queries.items():
-            ranked_docs = self.rank_documents(query)
-            results[query_id] = {doc_id: score for doc_id, score in ranked_docs[:top_k]}
-        return results    
+        Results of method(query_terms[, k]) through self.result_cache. BM25 scores only depend
+        on the multiset of query terms (or the term weights), so the key uses them sorted.
+        """
+        cache = self.result_cache
+        index_version = self.inverted_index.fingerprint
+        terms = sorted(query_terms.items()) if isinstance(query_terms, dict) else sorted(query_terms)
+        key = cache_key(f"bm25.{method.__name__}", [self.k1, self.b, self._fixed_avgdl], terms, k, index_version)
+        results = cache.get(key, index_version)
+        if results is None:
+            results = method(query_terms) if k is None else method(query_terms, k)
+            cache.put(key, index_version, results)
+        return results
 
+    @timed("bm25.rank_documents")
     def rank_documents(self, query_terms):
         """
-        Rank documents according to their relevance to a given set of query terms using BM25
+        Rank documents according to their relevance to a given set of query terms using BM25.
+
+        Term-at-a-time: each query term's postings are traversed once and its
+        contribution is added to a per-document accumulator. Repeated query
+        terms are weighted by their query frequency.
+        """
+        if self.result_cache is not None:
+            return self._cached(self._rank_documents, query_terms, None)
+        return self._rank_documents(query_terms)
+
+    def _rank_documents(self, query_terms):
+        plan = self._query_plan(query_terms)  # refreshes doc_norms after index updates
+        scores = defaultdict(float)
+        doc_norms = self.doc_norms
+        traversed = 0
+        for weight, _, postings in plan:
+            traversed += len(postings)
+            for doc_id, tf in postings.items():
+                scores[doc_id] += weight * tf / (tf + doc_norms[doc_id])
+        count("bm25.postings_traversed", traversed)
+        count("bm25.docs_scored", len(scores))
+        return self._ranked(scores)
+
+    @timed("bm25.top_k")
+    def top_k(self, query_terms, k=1000):
+        """
+        Return the k best documents, identical to rank_documents(query_terms)[:k].
+
+        Term-at-a-time MaxScore: terms are processed in decreasing order of their
+        upper-bound score. Once the remaining terms' bounds sum to less than the current
+        k-th best score, no unseen document can enter the top k, so the remaining terms
+        only update existing candidates (looked up by binary search instead of walking
+        the postings), and candidates that can no longer reach the top k are dropped.
         """
-        scores = {}
-        for term in query_terms:
-            #print(term)
-            if term in self.inverted_index:
-                for doc_id in self.inverted_index[term]:
-                    #print(doc_id)
-                    if doc_id not in scores:
-                        scores[doc_id] = 0
-                    scores[doc_id] += self.bm25_score(doc_id, query_terms)
-        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if k <= 0:
+            return []
+        if self.result_cache is not None:
+            return self._cached(self._top_k, query_terms, k)
+        return self._top_k(query_terms, k)
+
+    def _top_k(self, query_terms, k):
+        plan = self._query_plan(query_terms)
+        doc_norms = self.doc_norms
+        remaining = [0.0] * (len(plan) + 1)
+        for i in range(len(plan) - 1, -1, -1):
+            remaining[i] = remaining[i + 1] + plan[i][1]
+
+        scores = defaultdict(float)
+        threshold = 0.0
+        traversed = lookups = 0
+        i = 0
+        while i < len(plan):
+            if len(scores) >= k:
+                threshold = heapq.nlargest(k, scores.values())[-1]
+                if remaining[i] * (1 + _PRUNE_SLACK) < threshold:
+                    break
+            weight, _, postings = plan[i]
+            traversed += len(postings)
+            for doc_id, tf in postings.items():
+                scores[doc_id] += weight * tf / (tf + doc_norms[doc_id])
+            i += 1
+
+        count("bm25.docs_scored", len(scores))
+        count("bm25.terms_pruned", len(plan) - i)
+        scores = dict(scores)
+        for j in range(i, len(plan)):
+            cutoff = threshold - remaining[j] * (1 + _PRUNE_SLACK)
+            scores = {doc_id: score for doc_id, score in scores.items() if score >= cutoff}
+            weight, _, postings = plan[j]
+            if len(scores) * 8 < len(postings):
+                # Binary search (compressed postings: skip table, then only the blocks needed)
+                lookups += len(scores)
+                for doc_id, tf in postings.lookup(scores):
+                    scores[doc_id] += weight * tf / (tf + doc_norms[doc_id])
+            else:
+                traversed += len(postings)
+                for doc_id, tf in postings.items():
+                    if doc_id in scores:
+                        scores[doc_id] += weight * tf / (tf + doc_norms[doc_id])
+
+        count("bm25.postings_traversed", traversed)
+        count("bm25.posting_lookups", lookups)
+        best = heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+        doc_names = self.inverted_index.doc_names
+        return [(doc_names[doc_id], score) for doc_id, score in best]
+
+# Ranker inherited by forked search workers (see BM25.search).
+_shared_ranker = None
+
+def _search_chunk(chunk, top_k):
+    return _shared_ranker._search_chunk(chunk, top_k)
+
+# Relative slack on upper bounds when pruning, so floating-point rounding in the
+# bound sums can never discard a document that belongs in the top k.
+_PRUNE_SLACK = 1e-9
 
 def normalize_scores(ranked_docs):
         if not ranked_docs:
@@ -61,4 +310,4 @@ def normalize_scores(ranked_docs):
         min_score = min(score for _, score in ranked_docs)
         if max_score == min_score:
             return [(doc_id, 1.0) for doc_id, _ in ranked_docs]
-        return [(doc_id, (score - min_score) / (max_score - min_score)) for doc_id, score in ranked_docs]
\ No newline at end of file
+        return [(doc_id, (score - min_score) / (max_score - min_score)) for doc_id, score in ranked_docs]
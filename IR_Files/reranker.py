@@ -0,0 +1,122 @@
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from instrumentation import count, timer
+
+
+def query_hash(query):
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+
+class ScoreCache:
+    """
+    Persistent (model, query hash, doc ID) -> score store, kept in a SQLite file so
+    repeated experiments reuse cross-encoder scores of identical pairs
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS scores (model TEXT, query TEXT, doc TEXT, score REAL, "
+                                "PRIMARY KEY (model, query, doc)) WITHOUT ROWID")
+
+    def get(self, model_name, query_digest, doc_ids):
+        """
+        Cached scores of doc_ids for one query, as {doc_id: score} (missing pairs are absent)
+        """
+        rows = self.connection.execute("SELECT doc, score FROM scores WHERE model = ? AND query = ?",
+                                       (model_name, query_digest))
+        wanted = set(doc_ids)
+        return {doc_id: score for doc_id, score in rows if doc_id in wanted}
+
+    def put(self, model_name, entries):
+        """
+        Store (query hash, doc ID, score) triples
+        """
+        self.connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                                    ((model_name, query_digest, doc_id, float(score))
+                                     for query_digest, doc_id, score in entries))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def length_batches(lengths, batch_size, max_batch_tokens):
+    """
+    Group pair indices into batches of similar length: pairs are sorted by length and a
+    batch is closed when it holds batch_size pairs or its padded size (longest * count)
+    would exceed max_batch_tokens
+    """
+    order = np.argsort(lengths, kind='stable')
+    batch, longest = [], 0
+    for i in order:
+        length = max(1, int(lengths[i]))
+        if batch and (len(batch) == batch_size or max(longest, length) * (len(batch) + 1) > max_batch_tokens):
+            yield batch
+            batch, longest = [], 0
+        batch.append(int(i))
+        longest = max(longest, length)
+    if batch:
+        yield batch
+
+
+class CrossEncoderReranker:
+    """
+    Rerank the top `depth` documents of each query's first-stage results with a
+    cross-encoder (anything with BEIR's CrossEncoder.predict(pairs, batch_size)).
+
+    Pairs are bucketed by length (see length_batches) so each batch pads to a similar
+    size, and scores are looked up in / added to an optional ScoreCache.
+    Lengths are whitespace token counts capped at max_length, the encoder's truncation.
+    """
+
+    def __init__(self, model, model_name, batch_size=128, depth=100, cache_path=None, max_length=512,
+                 max_batch_tokens=16384):
+        self.model = model
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.depth = depth
+        self.cache = ScoreCache(cache_path) if cache_path is not None else None
+        self.max_length = max_length
+        self.max_batch_tokens = max_batch_tokens
+
+    def _score(self, pairs):
+        lengths = np.array([min(self.max_length, len(query.split()) + len(doc.split())) for query, doc in pairs])
+        scores = np.empty(len(pairs), dtype=np.float64)
+        for batch in length_batches(lengths, self.batch_size, self.max_batch_tokens):
+            scores[batch] = np.asarray(self.model.predict([pairs[i] for i in batch], batch_size=len(batch),
+                                                          show_progress_bar=False), dtype=np.float64)
+        return scores
+
+    def rerank(self, corpus, queries, results, top_k=None):
+        """
+        Return {query_id: {doc_id: cross-encoder score}} for the top min(top_k, depth)
+        first-stage documents of each query
+        """
+        depth = self.depth if top_k is None else min(top_k, self.depth)
+        reranked, missing = {}, []
+        for query_id, scores in results.items():
+            candidates = sorted(scores, key=lambda doc_id: -scores[doc_id])[:depth]
+            digest = query_hash(queries[query_id])
+            cached = self.cache.get(self.model_name, digest, candidates) if self.cache is not None else {}
+            reranked[query_id] = cached
+            count("rerank.cache_hits", len(cached))
+            missing.extend((query_id, digest, doc_id) for doc_id in candidates if doc_id not in cached)
+
+        if missing:
+            print(f"Scoring {len(missing)} query-document pairs with {self.model_name}")
+            pairs = [(queries[query_id], (corpus[doc_id].get('title', '') + " " + corpus[doc_id].get('text', '')).strip())
+                     for query_id, _, doc_id in missing]
+            count("rerank.pairs_scored", len(pairs))
+            with timer("rerank.score"):
+                scores = self._score(pairs)
+            for (query_id, _, doc_id), score in zip(missing, scores.tolist()):
+                reranked[query_id][doc_id] = score
+            if self.cache is not None:
+                self.cache.put(self.model_name, ((digest, doc_id, score)
+                                                 for (_, digest, doc_id), score in zip(missing, scores.tolist())))
+        return {query_id: dict(sorted(scores.items(), key=lambda item: -item[1]))
+                for query_id, scores in reranked.items()}
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from instrumentation import count
+
+DEFAULT_MAX_ENTRIES = 10000
+# Index versions whose results are kept at once: while an index is reloaded, requests still
+# running on the previous version keep using its entries next to the new version's.
+MAX_INDEX_VERSIONS = 2
+# Evicted versions remembered so that late lookups and puts for them are ignored.
+_MAX_RETIRED_VERSIONS = 64
+
+
+def cache_key(model, params, tokens, top_k, index_version):
+    """
+    Key of one query's results: the model name and parameters, the normalized query
+    tokens (from preprocess_text for BM25; the lower-cased words of the raw text for
+    models that encode it), the cut-off and the index version they were computed on
+    """
+    data = json.dumps([model, params, list(tokens), top_k, index_version], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Query result cache: a size-bounded LRU of ranked [(doc_id, score), ...] lists with
+    an optional time-to-live, in front of an optional SQLite file shared between runs
+    (same layout idea as reranker.ScoreCache).
+
+    Results are only valid for the index they were computed on: keys include the index
+    version (BaseIndex.fingerprint). Entries of the max_versions most recently used
+    versions are kept; when another version is used, the least recently used one is
+    dropped from memory and disk, and later lookups and puts for it are ignored (a
+    request that outlives two index reloads cannot evict newer results). The first
+    version used also drops rows that earlier runs left on disk. Thread-safe.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=None, disk_path=None, max_versions=MAX_INDEX_VERSIONS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_versions = max_versions
+        self.entries = OrderedDict()  # key -> (expiry time or None, results, index version)
+        self.versions = OrderedDict()  # index versions with entries, least recently used first
+        self._retired = OrderedDict()  # evicted index versions
+        self.stats_counter = Counter()
+        self._lock = threading.Lock()
+        self.disk_path = disk_path
+        self.disk = None
+        if disk_path is not None:
+            self._connect()
+
+    def _connect(self):
+        # SQLite connections must not be shared with forked processes (see BM25.search).
+        self._pid = os.getpid()
+        self.disk = sqlite3.connect(self.disk_path, check_same_thread=False)
+        self.disk.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, index_version TEXT, "
+                          "expires REAL, results TEXT) WITHOUT ROWID")
+
+    def _record(self, event):
+        self.stats_counter[event] += 1
+        count(f"result_cache.{event}")
+
+    def _use_version(self, index_version):
+        """
+        Mark index_version as used; False if it was evicted (called with the lock held)
+        """
+        if self.disk is not None and self._pid != os.getpid():
+            self._connect()
+        if index_version in self.versions:
+            self.versions.move_to_end(index_version)
+            return True
+        if index_version in self._retired:
+            return False
+        purge_disk = not self.versions
+        self.versions[index_version] = None
+        while len(self.versions) > self.max_versions:
+            old_version = self.versions.popitem(last=False)[0]
+            self._retired[old_version] = None
+            if len(self._retired) > _MAX_RETIRED_VERSIONS:
+                self._retired.popitem(last=False)
+            for key in [key for key, entry in self.entries.items() if entry[2] == old_version]:
+                del self.entries[key]
+            self._record("invalidations")
+            purge_disk = True
+        if purge_disk and self.disk is not None:
+            versions = list(self.versions)
+            self.disk.execute(f"DELETE FROM results WHERE index_version NOT IN ({','.join('?' * len(versions))})",
+                              versions)
+            self.disk.commit()
+        return True
+
+    def get(self, key, index_version):
+        """
+        Cached results for key, or None
+        """
+        now = time.time()
+        with self._lock:
+            if not self._use_version(index_version):
+                self._record("misses")
+                return None
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] is None or entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self._record("hits")
+                    self._record("memory_hits")
+                    return list(entry[1])
+                del self.entries[key]
+                self._record("expired")
+            if self.disk is not None:
+                row = self.disk.execute("SELECT expires, results FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and (row[0] is None or row[0] > now):
+                    results = tuple((doc_id, score) for doc_id, score in json.loads(row[1]))
+                    self._insert(key, row[0], results, index_version)
+                    self._record("hits")
+                    self._record("disk_hits")
+                    return list(results)
+            self._record("misses")
+            return None
+
+    def put(self, key, index_version, results):
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        results = tuple(results)
+        with self._lock:
+            if not self._use_version(index_version):
+                return
+            self._insert(key, expires, results, index_version)
+            if self.disk is not None:
+                self.disk.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                  (key, index_version, expires, json.dumps(results)))
+                self.disk.commit()
+
+    def _insert(self, key, expires, results, index_version):
+        self.entries[key] = (expires, results, index_version)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self._record("evictions")
+
+    def invalidate(self):
+        """
+        Drop every cached result, in memory and on disk
+        """
+        with self._lock:
+            self.entries.clear()
+            self.versions.clear()
+            if self.disk is not None:
+                if self._pid != os.getpid():
+                    self._connect()
+                self.disk.execute("DELETE FROM results")
+                self.disk.commit()
+            self._record("invalidations")
+
+    def stats(self):
+        """
+        Hit/miss counts, hit rate and current size
+        """
+        with self._lock:
+            stats = {event: self.stats_counter[event] for event in
+                     ("hits", "memory_hits", "disk_hits", "misses", "expired", "evictions", "invalidations")}
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+            stats["entries"] = len(self.entries)
+            return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
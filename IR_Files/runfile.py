@@ -0,0 +1,274 @@
+import json
+import os
+import struct
+from array import array
+from collections.abc import Mapping
+
+from indexing import _DocNames, _map_file, _pad8
+
+RUN_MAGIC = b'VSMR'
+RUN_FORMAT_VERSION = 1
+RUN_EXTENSION = '.run'
+_RUN_HEADER = struct.Struct('<4sIQQQ')  # magic, version, queries, distinct docs, entries
+
+
+def iter_json_run(file_path, chunk_size=1 << 20):
+    """
+    Stream a JSON run file ({query_id: [[doc_id, score], ...]}) one query at a time,
+    without loading the whole file. Yields (query_id, [(doc_id, score), ...]).
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as file:
+        buffer, pos, eof = '', 0, False
+
+        def fill(size=chunk_size):
+            nonlocal buffer, pos, eof
+            chunk = file.read(size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in chars):
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                fill()
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # A value ending at the buffer edge may be truncated (e.g. a number).
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                # Grow geometrically so a value spanning many chunks is re-parsed O(log n) times.
+                fill(max(chunk_size, len(buffer) - pos))
+
+        fill()
+        skip('{')
+        while pos < len(buffer) and buffer[pos] != '}':
+            query_id = decode()
+            skip(':')
+            ranked = decode()
+            yield query_id, [(doc_id, score) for doc_id, score in ranked]
+            skip(',')
+
+
+def write_json_run(output_file, ranked_queries):
+    """
+    Write (query_id, [(doc_id, score), ...]) pairs incrementally as a JSON run file, one query per line
+    """
+    count = 0
+    with open(output_file, 'w', encoding='utf-8') as file:
+        file.write('{')
+        for query_id, ranked in ranked_queries:
+            file.write(',\n' if count else '\n')
+            file.write(f"{json.dumps(query_id)}: {json.dumps([[doc_id, float(score)] for doc_id, score in ranked])}")
+            count += 1
+        file.write('\n}\n')
+    return count
+
+
+def write_trec(output_file, ranked_queries, tag="vsm"):
+    """
+    Write (query_id, [(doc_id, score), ...]) pairs as TREC run lines: query Q0 doc rank score tag
+    """
+    count = 0
+    with open(output_file, 'w', encoding='utf-8') as file:
+        for query_id, ranked in ranked_queries:
+            for rank, (doc_id, score) in enumerate(ranked, start=1):
+                file.write(f"{query_id} Q0 {doc_id} {rank} {score} {tag}\n")
+            count += 1
+    return count
+
+
+class RunWriter:
+    """
+    Build a binary run file query by query. Layout of the single file:
+
+      header             magic, version, query count, distinct doc count, entry count
+      entry offsets      uint64[queries + 1], query q owns entries [offsets[q], offsets[q + 1])
+      query name offsets uint64[queries + 1] into the query name blob
+      doc name offsets   uint64[docs + 1] into the doc name blob
+      doc rows           int32[entries], index into the doc name table
+      scores             float32[entries], best first within each query
+      query names, doc names   UTF-8 blobs
+
+    Columns are kept as compact arrays until close(), which writes the file to a
+    temporary name and renames it into place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entry_offsets = array('Q', [0])
+        self._query_names = []
+        self._doc_rows = array('i')
+        self._scores = array('f')
+        self._doc_ids = {}
+
+    def add(self, query_id, ranked):
+        for doc_id, score in ranked:
+            self._doc_rows.append(self._doc_ids.setdefault(doc_id, len(self._doc_ids)))
+            self._scores.append(score)
+        self._entry_offsets.append(len(self._doc_rows))
+        self._query_names.append(str(query_id))
+
+    def close(self):
+        query_offsets, query_blob = _string_table(self._query_names)
+        doc_offsets, doc_blob = _string_table(self._doc_ids)
+        partial_path = self.path + '.partial'
+        with open(partial_path, 'wb') as file:
+            file.write(_RUN_HEADER.pack(RUN_MAGIC, RUN_FORMAT_VERSION, len(self._query_names), len(self._doc_ids),
+                                        len(self._doc_rows)))
+            for column in (self._entry_offsets, query_offsets, doc_offsets, self._doc_rows, self._scores):
+                column.tofile(file)
+            file.write(b'\0' * (_pad8(file.tell()) - file.tell()))
+            file.write(query_blob)
+            file.write(doc_blob)
+        os.replace(partial_path, self.path)
+        return len(self._query_names)
+
+
+def _string_table(strings):
+    offsets, parts = array('Q', [0]), []
+    for string in strings:
+        data = string.encode('utf-8')
+        parts.append(data)
+        offsets.append(offsets[-1] + len(data))
+    return offsets, b''.join(parts)
+
+
+def write_run_file(output_file, ranked_queries):
+    """
+    Write (query_id, [(doc_id, score), ...]) pairs as a binary run file; returns the query count
+    """
+    writer = RunWriter(output_file)
+    for query_id, ranked in ranked_queries:
+        writer.add(query_id, ranked)
+    return writer.close()
+
+
+class RunFile(Mapping):
+    """
+    Read-only binary run file, opened with mmap: query_id -> [(doc_id, score), ...].
+
+    Opening only parses the header; a query's rows are decoded when it is accessed,
+    and the doc_rows / scores columns are exposed for vectorised consumers.
+    """
+
+    def __init__(self, path):
+        data = _map_file(path)
+        if len(data) < _RUN_HEADER.size:
+            raise ValueError(f"{path}: truncated run file header")
+        magic, version, num_queries, num_docs, num_entries = _RUN_HEADER.unpack_from(data)
+        if magic != RUN_MAGIC:
+            raise ValueError(f"{path}: not a binary run file")
+        if version != RUN_FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported run format version {version}")
+        pos = _RUN_HEADER.size
+        self.entry_offsets = data[pos:pos + 8 * (num_queries + 1)].cast('Q')
+        pos += 8 * (num_queries + 1)
+        query_offsets = data[pos:pos + 8 * (num_queries + 1)].cast('Q')
+        pos += 8 * (num_queries + 1)
+        doc_offsets = data[pos:pos + 8 * (num_docs + 1)].cast('Q')
+        pos += 8 * (num_docs + 1)
+        self.doc_rows = data[pos:pos + 4 * num_entries].cast('i')
+        pos += 4 * num_entries
+        self.scores = data[pos:pos + 4 * num_entries].cast('f')
+        pos = _pad8(pos + 4 * num_entries)
+        self.query_ids = _DocNames(query_offsets, data[pos:pos + query_offsets[-1]])
+        pos += query_offsets[-1]
+        self.doc_ids = _DocNames(doc_offsets, data[pos:pos + doc_offsets[-1]])
+        self._query_index = None
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    def __iter__(self):
+        return iter(self.query_ids)
+
+    def __contains__(self, query_id):
+        return self.query_index(query_id) is not None
+
+    def query_index(self, query_id):
+        if self._query_index is None:
+            self._query_index = {name: i for i, name in enumerate(self.query_ids)}
+        return self._query_index.get(str(query_id))
+
+    def ranked(self, i, doc_ids=None):
+        """
+        Ranked list of the i-th query in the file; doc_ids may be a pre-decoded doc name list
+        """
+        start, end = self.entry_offsets[i], self.entry_offsets[i + 1]
+        doc_ids = self.doc_ids if doc_ids is None else doc_ids
+        return list(zip(map(doc_ids.__getitem__, self.doc_rows[start:end].tolist()), self.scores[start:end].tolist()))
+
+    def __getitem__(self, query_id):
+        i = self.query_index(query_id)
+        if i is None:
+            raise KeyError(query_id)
+        return self.ranked(i)
+
+    def items(self):
+        # Reading every query: decode the doc name table once instead of per entry.
+        doc_ids = self.doc_ids[:]
+        for i, query_id in enumerate(self.query_ids):
+            yield query_id, self.ranked(i, doc_ids)
+
+    def to_dict(self):
+        return {query_id: dict(ranked) for query_id, ranked in self.items()}
+
+
+def is_binary_run(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(RUN_MAGIC)) == RUN_MAGIC
+
+
+def iter_run(file_path, chunk_size=1 << 20):
+    """
+    Stream (query_id, [(doc_id, score), ...]) pairs from a binary or JSON run file
+    """
+    if is_binary_run(file_path):
+        return RunFile(file_path).items()
+    return iter_json_run(file_path, chunk_size)
+
+
+def write_run(output_file, ranked_queries, tag="vsm"):
+    """
+    Write (query_id, [(doc_id, score), ...]) pairs in the format the file name selects:
+    binary for *.run, JSON if the name contains 'json', TREC text otherwise
+    """
+    if output_file.endswith(RUN_EXTENSION):
+        return write_run_file(output_file, ranked_queries)
+    if 'json' in output_file:
+        return write_json_run(output_file, ranked_queries)
+    return write_trec(output_file, ranked_queries, tag)
+
+
+def load_run(file_path):
+    """
+    Load a binary or JSON run file as {query_id: {doc_id: score}}
+    """
+    return {query_id: dict(ranked) for query_id, ranked in iter_run(file_path)}
+
+
+def convert_json_run(json_path, run_path):
+    """
+    Convert a JSON run file into the binary format; returns the query count
+    """
+    return write_run_file(run_path, iter_json_run(json_path))
+
+
+def export_trec(run_path, trec_path, tag="vsm"):
+    """
+    Export a binary (or JSON) run file as TREC text; returns the query count
+    """
+    return write_trec(trec_path, iter_run(run_path), tag)
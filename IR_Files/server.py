@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from feedback import RM3
+from indexing import load_binary_index
+from parser import iter_documents_from_file
+from preprocessing import load_stopwords, preprocess_text
+from ranking import BM25
+from result_cache import ResultCache, cache_key
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_TOP_K = 10
+MAX_BATCH_QUERIES = 64   # Queries encoded together by one micro-batch of a dense model
+MAX_BATCH_WAIT = 0.005   # Seconds a micro-batch waits for more requests after the first
+MAX_REQUEST_BYTES = 1 << 22
+LEXICAL_MODELS = ("bm25", "bm25-rm3")  # ranked over the current IndexState, on the thread pool
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+
+
+class IndexState:
+    """
+    Everything that belongs to one loaded index. Requests take the current state once,
+    so a reload (which swaps the whole object) never mixes two indexes in one answer.
+    """
+
+    def __init__(self, index_path, generation, result_cache=None):
+        self.index_path = index_path
+        self.generation = generation
+        self.index = load_binary_index(index_path)
+        self.bm25 = BM25(self.index, result_cache=result_cache)
+        self.rankers = {"bm25": self.bm25, "bm25-rm3": RM3(self.bm25)}  # see LEXICAL_MODELS
+        self.loaded_at = time.time()
+
+
+class MicroBatcher:
+    """
+    Collect concurrent requests for one model into a single search call: the first
+    request opens a batch that is closed after max_wait seconds or max_queries
+    queries, then run on the model's own thread so the event loop stays responsive.
+    Each request carries the IndexState it started with; only requests of the same
+    generation are merged, and search(state, queries, top_k) runs on that state.
+    """
+
+    def __init__(self, search, max_queries=MAX_BATCH_QUERIES, max_wait=MAX_BATCH_WAIT):
+        self.search = search
+        self.max_queries = max_queries
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)  # encoders are not assumed thread-safe
+        self.task = None
+
+    async def submit(self, state, queries, top_k):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((state, queries, top_k, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][1])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_queries:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                size += len(batch[-1][1])
+
+            # A reload may land while the batch is open: requests started on different
+            # index generations are searched separately.
+            generations = {}
+            for request in batch:
+                generations.setdefault(request[0].generation, []).append(request)
+            for requests in generations.values():
+                await self._search_batch(loop, requests)
+
+    async def _search_batch(self, loop, batch):
+        # Query IDs are only unique within a request, so they are prefixed with its position.
+        merged = {f"{i}:{query_id}": text for i, (_, queries, _, _) in enumerate(batch)
+                  for query_id, text in queries.items()}
+        top_k = max(request_top_k for _, _, request_top_k, _ in batch)
+        instrumentation.count("server.micro_batches")
+        instrumentation.count("server.micro_batched_queries", len(merged))
+        try:
+            results = await loop.run_in_executor(self.executor, self.search, batch[0][0], merged, top_k)
+        except Exception as error:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for i, (_, queries, request_top_k, future) in enumerate(batch):
+            if not future.done():
+                future.set_result({query_id: _top(results.get(f"{i}:{query_id}", {}), request_top_k)
+                                   for query_id in queries})
+
+
+def _top(scores, top_k):
+    return dict(sorted(scores.items(), key=lambda item: -item[1])[:top_k])
+
+
+class SearchServer:
+    """
+    Long-running query server over a warm index: stopwords, the index and any model
+    backends are loaded once, and queries are answered over HTTP/1.1 (TCP or a Unix socket).
+
+      GET  /health    index path, generation, document count, models, uptime
+      GET  /metrics   instrumentation timers and counters (see instrumentation)
+      POST /search    {"query": text} or {"queries": {query_id: text}},
+                      optional "top_k" and "model" (default "bm25");
+                      returns {"results": {query_id: {doc_id: score}}, "generation", "took_ms"}
+      POST /reload    {"index": directory} (default: the current one); loads the index
+                      in the background and swaps it in atomically
+
+    BM25 queries (and BM25 with RM3 expansion, model "bm25-rm3") run on a thread pool
+    over the current index; dense, sparse and hybrid models (see
+    beir_ranking.MODEL_LOADERS) are micro-batched (see MicroBatcher). To update the
+    index, build it into a new directory and reload with its path. With a
+    result_cache (see result_cache.ResultCache) repeated queries of any model are
+    answered from the cache until the index is reloaded.
+    """
+
+    def __init__(self, index_path, stopwords_path, stem=True, models=(), corpus_path=None, workers=4,
+                 result_cache=None):
+        self.stopwords = load_stopwords(stopwords_path)
+        self.stem = stem
+        self.tokens("warm up")  # creates the stemmer now instead of on the first request
+        self.result_cache = result_cache
+        self.state = IndexState(index_path, generation=1, result_cache=result_cache)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._reload_lock = None
+        self.started_at = time.time()
+        self.models, self.model_names, self.batchers = {}, {}, {}
+        self.lexical_models = {"bm25"} | {model_type for _, model_type in models if model_type in LEXICAL_MODELS}
+        models = [(model_name, model_type) for model_name, model_type in models if model_type not in LEXICAL_MODELS]
+        if models:
+            self._load_models(models, corpus_path)
+
+    def _load_models(self, models, corpus_path):
+        from beir_ranking import HYBRID_DENSE_TYPE, _text, load_model
+        if corpus_path is None:
+            raise ValueError("Model backends need the corpus text (corpus_path)")
+        self.corpus = {doc['DOCNO']: {"title": _text(doc['HEAD']), "text": _text(doc['TEXT'])}
+                       for doc in iter_documents_from_file(corpus_path)}
+        for model_name, model_type in models:
+            model = load_model(model_name, model_type, self.corpus, self.state.index)
+            dense_type = HYBRID_DENSE_TYPE if model_type == "hybrid" else model_type
+            score_function = "dot" if dense_type == "ance" else "cos_sim"
+            self.models[model_type] = model
+            self.model_names[model_type] = model_name
+            self.batchers[model_type] = MicroBatcher(self._model_search(model_type, model, score_function))
+
+    def _model_search(self, model_type, model, score_function):
+        def search(state, queries, top_k):
+            if model_type == "hybrid":
+                # Candidates come from the requests' index, so hybrid results follow reloads.
+                terms = {query_id: self.tokens(text) for query_id, text in queries.items()}
+                return model.search(self.corpus, queries, top_k, score_function, query_terms=terms, bm25=state.bm25)
+            return model.search(self.corpus, queries, top_k, score_function)
+        return search
+
+    def tokens(self, text):
+        return preprocess_text(text, self.stopwords, self.stem)
+
+    def _lexical_search(self, state, model_type, queries, top_k):
+        ranker = state.rankers[model_type]
+        with instrumentation.timer(f"server.{model_type}_batch"):
+            return {query_id: dict(ranker.top_k(self.tokens(text), top_k)) for query_id, text in queries.items()}
+
+    async def search(self, request):
+        if "query" in request:
+            queries = {"0": request["query"]}
+        else:
+            queries = request["queries"]
+        if not isinstance(queries, dict) or not all(isinstance(text, str) for text in queries.values()):
+            raise ValueError('"queries" must map query IDs to query text')
+        top_k = int(request.get("top_k", DEFAULT_TOP_K))
+        if top_k < 1:
+            raise ValueError('"top_k" must be at least 1')
+        model_type = request.get("model", "bm25")
+        start_time = time.perf_counter()
+        state = self.state
+        instrumentation.count("server.queries", len(queries))
+        if model_type in self.lexical_models:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self._lexical_search, state,
+                                                                       model_type, queries, top_k)
+        elif model_type in self.batchers:
+            results = await self._search_model(state, model_type, queries, top_k)
+        else:
+            raise ValueError(f"Model not loaded: {model_type}")
+        return {"results": results, "generation": state.generation,
+                "took_ms": 1000 * (time.perf_counter() - start_time)}
+
+    async def _search_model(self, state, model_type, queries, top_k):
+        cache = self.result_cache
+        if cache is None:
+            return await self.batchers[model_type].submit(state, queries, top_k)
+        index_version = state.index.fingerprint
+        # Models encode the raw text (stopwords and negations included), so only case and
+        # whitespace are normalised; the BM25 tokens would merge queries they rank differently.
+        keys = {query_id: cache_key(f"{model_type}:{self.model_names[model_type]}", None, text.lower().split(), top_k,
+                                    index_version) for query_id, text in queries.items()}
+        results, missing = {}, {}
+        for query_id, key in keys.items():
+            if key in results or key in missing:
+                continue
+            cached = cache.get(key, index_version)
+            if cached is None:
+                missing[key] = queries[query_id]  # queries normalizing to the same text are searched once
+            else:
+                results[key] = dict(cached)
+        if missing:
+            for key, scores in (await self.batchers[model_type].submit(state, missing, top_k)).items():
+                cache.put(key, index_version, scores.items())
+                results[key] = scores
+        return {query_id: results[key] for query_id, key in keys.items()}
+
+    async def reload(self, request):
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            index_path = request.get("index", self.state.index_path)
+            with instrumentation.timer("server.reload"):
+                state = await asyncio.get_running_loop().run_in_executor(
+                    None, IndexState, index_path, self.state.generation + 1, self.result_cache)
+            self.state = state  # in-flight requests keep the state they started with
+        print(f"Reloaded index {index_path} (generation {state.generation}, {state.bm25.N} documents)")
+        return {"index": index_path, "generation": state.generation, "num_docs": state.bm25.N}
+
+    async def health(self, request):
+        state = self.state
+        return {"status": "ok", "index": state.index_path, "generation": state.generation, "num_docs": state.bm25.N,
+                "models": ["bm25"] + sorted((self.lexical_models - {"bm25"}) | set(self.models)),
+                "uptime_seconds": time.time() - self.started_at,
+                "result_cache": self.result_cache.stats() if self.result_cache is not None else None}
+
+    async def metrics(self, request):
+        return instrumentation.snapshot()
+
+    async def dispatch(self, method, path, body):
+        routes = {("GET", "/health"): self.health, ("GET", "/metrics"): self.metrics,
+                  ("POST", "/search"): self.search, ("POST", "/reload"): self.reload}
+        handler = routes.get((method, path.split('?', 1)[0]))
+        if handler is None:
+            return 404, {"error": f"No route for {method} {path}"}
+        try:
+            request = json.loads(body) if body else {}
+            if not isinstance(request, dict):
+                raise ValueError("Request body must be a JSON object")
+            return 200, await handler(request)
+        except (KeyError, TypeError, ValueError, FileNotFoundError) as error:
+            return 400, {"error": f"{type(error).__name__}: {error}"}
+        except Exception as error:
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve HTTP/1.1 requests on one connection (keep-alive unless the client closes)
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request"}, keep_alive=False)
+                    break
+                if length > MAX_REQUEST_BYTES:
+                    await self._respond(writer, 413, {"error": "Request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive=True):
+        data = json.dumps(payload).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                     .encode('latin-1') + data)
+        await writer.drain()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None):
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            print(f"Serving on unix:{unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Serve BM25 and model queries over a warm index")
+    arg_parser.add_argument('--index', default='inverted_index')
+    arg_parser.add_argument('--stopwords', default='List of Stopwords.html')
+    arg_parser.add_argument('--no-stem', action='store_true', help="the index was built without stemming")
+    arg_parser.add_argument('--model', nargs=2, action='append', default=[], metavar=('NAME', 'TYPE'),
+                            help="also serve a beir_ranking model, e.g. --model msmarco-distilbert-base-v3 sentence-bert")
+    arg_parser.add_argument('--corpus', default='scifact/corpus.jsonl', help="corpus text, needed by --model")
+    arg_parser.add_argument('--host', default=DEFAULT_HOST)
+    arg_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    arg_parser.add_argument('--unix', default=None, help="listen on this Unix socket instead of TCP")
+    arg_parser.add_argument('--workers', type=int, default=4, help="threads answering BM25 queries")
+    arg_parser.add_argument('--cache-size', type=int, default=0, help="cache results of this many queries (0 = off)")
+    arg_parser.add_argument('--cache-ttl', type=float, default=None, help="seconds a cached result stays valid")
+    arg_parser.add_argument('--cache-file', default=None, help="also keep cached results in this SQLite file")
+    args = arg_parser.parse_args()
+    result_cache = ResultCache(args.cache_size, args.cache_ttl, args.cache_file) if args.cache_size > 0 else None
+    server = SearchServer(args.index, args.stopwords, stem=not args.no_stem,
+                          models=[tuple(model) for model in args.model], corpus_path=args.corpus, workers=args.workers,
+                          result_cache=result_cache)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,155 @@
+import itertools
+import json
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from batch_ranking import BM25_VARIANTS, BM25Matrix
+from evaluation import Evaluator, RunColumns
+from ranking import BM25
+
+DEFAULT_K1_VALUES = (0.6, 0.9, 1.2, 1.5, 1.8, 2.1)
+DEFAULT_B_VALUES = (0.3, 0.45, 0.6, 0.75, 0.9)
+
+
+def parameter_grid(k1_values=DEFAULT_K1_VALUES, b_values=DEFAULT_B_VALUES, variants=BM25_VARIANTS):
+    """
+    Every (variant, k1, b) combination; BM25-adpt fits k1 per term, so it only varies b
+    """
+    configs = []
+    for variant in variants:
+        for k1, b in itertools.product([None] if variant == "bm25-adpt" else k1_values, b_values):
+            configs.append({"variant": variant, "k1": k1 if k1 is not None else 1.2, "b": b})
+    return configs
+
+
+def random_configs(n, k1_range=(0.2, 3.0), b_range=(0.0, 1.0), variants=BM25_VARIANTS, seed=0):
+    """
+    n configurations with k1 and b drawn uniformly from the given ranges
+    """
+    rng = random.Random(seed)
+    return [{"variant": rng.choice(variants), "k1": round(rng.uniform(*k1_range), 3),
+             "b": round(rng.uniform(*b_range), 3)} for _ in range(n)]
+
+
+class BM25Sweep:
+    """
+    Evaluate many BM25 configurations against one set of queries and qrels.
+
+    The index is compiled into a BM25Matrix and the queries into a query matrix once;
+    each configuration only recomputes the posting weights (BM25Matrix.term_weights),
+    runs one sparse product and is scored with the NumPy Evaluator. Configurations are
+    spread over forked worker processes that share the compiled matrices.
+    """
+
+    def __init__(self, bm25, queries, qrels, top_k=100, k_values=(10, 100), metric="NDCG@10"):
+        self.matrix = BM25Matrix(bm25)
+        self.top_k = top_k
+        self.metric = metric
+        self.evaluator = Evaluator(qrels, k_values)
+        self.query_ids = [query_id for query_id in queries if query_id in self.evaluator.qrels]
+        self.doc_names = list(self.matrix.doc_names)
+        self.queries = self.matrix.query_matrix(
+            [queries[query_id].split() if isinstance(queries[query_id], str) else queries[query_id]
+             for query_id in self.query_ids])
+
+    def search(self, config):
+        """
+        Top-k results of every query under config, as RunColumns (see evaluation)
+        """
+        weights = self.matrix.term_weights(config["k1"], config["b"], config["variant"], config.get("delta"))
+        ranked = self.matrix.top_k((self.queries @ weights).tocsr(), self.top_k)
+        offsets = np.zeros(len(ranked) + 1, dtype=np.int64)
+        np.cumsum([len(doc_ids) for doc_ids, _ in ranked], out=offsets[1:])
+        doc_rows = np.concatenate([doc_ids for doc_ids, _ in ranked]) if ranked else np.zeros(0, dtype=np.int32)
+        scores = np.concatenate([doc_scores for _, doc_scores in ranked]) if ranked else np.zeros(0)
+        return RunColumns(self.query_ids, offsets, doc_rows, scores, self.doc_names)
+
+    def evaluate(self, config):
+        return self.evaluator.evaluate(self.search(config))
+
+    def run(self, configs, workers=1):
+        """
+        Evaluate every configuration; returns [(config, metrics)] best first by self.metric
+        """
+        configs = list(configs)
+        if workers <= 1 or len(configs) <= 1:
+            results = [self.evaluate(config) for config in configs]
+        else:
+            global _shared_sweep
+            if "fork" in multiprocessing.get_all_start_methods():
+                _shared_sweep = self
+                try:
+                    with ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context("fork")) as pool:
+                        results = list(pool.map(_evaluate_config, configs))
+                finally:
+                    _shared_sweep = None
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(self.evaluate, configs))
+        return sorted(zip(configs, results), key=lambda item: -item[1][self.metric])
+
+
+# Sweep inherited by forked workers (see BM25Sweep.run).
+_shared_sweep = None
+
+def _evaluate_config(config):
+    return _shared_sweep.evaluate(config)
+
+
+def sweep(index, train_queries, train_qrels, test_queries=None, test_qrels=None, configs=None, workers=1,
+          metric="NDCG@10", report_top=5, output_file=None):
+    """
+    Grid-search (or evaluate the given) configurations on the train queries, print the
+    best report_top by metric and, when test data is given, score those on test too.
+    Returns {"train": [...], "test": [...]} lists of {"config", "metrics"}.
+    """
+    bm25 = BM25(index)
+    configs = parameter_grid() if configs is None else configs
+    start_time = time.time()
+    train = BM25Sweep(bm25, train_queries, train_qrels, metric=metric)
+    ranked = train.run(configs, workers)
+    print(f"Evaluated {len(configs)} configurations on {len(train.query_ids)} train queries "
+          f"in {time.time() - start_time:.2f} seconds")
+    report = {"train": [{"config": config, "metrics": metrics} for config, metrics in ranked]}
+    for config, metrics in ranked[:report_top]:
+        print(f"  {_describe(config)}: train {metric} {metrics[metric]:.4f}")
+
+    if test_queries is not None and test_qrels is not None:
+        test = BM25Sweep(bm25, test_queries, test_qrels, metric=metric)
+        report["test"] = []
+        for config, _ in ranked[:report_top]:
+            metrics = test.evaluate(config)
+            report["test"].append({"config": config, "metrics": metrics})
+            print(f"  {_describe(config)}: test {metric} {metrics[metric]:.4f}")
+    if output_file is not None:
+        with open(output_file, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    return report
+
+
+def _describe(config):
+    if config["variant"] == "bm25-adpt":
+        return f"bm25-adpt b={config['b']}"
+    return f"{config['variant']} k1={config['k1']} b={config['b']}"
+
+
+if __name__ == "__main__":
+    from indexing import load_binary_index
+    from parser import parse_queries_from_file
+    from preprocessing import load_stopwords, preprocess_queries
+    from evaluation import load_qrels
+
+    dataset = "scifact"
+    USE_STEMMING = True  # Must match the settings the index was built with
+    index = load_binary_index('inverted_index')
+    stopwords = load_stopwords('List of Stopwords.html')
+    queries = preprocess_queries(parse_queries_from_file(dataset + '/queries.jsonl'), stopwords, stem=USE_STEMMING)
+    query_terms = {query['num']: query['tokens'] for query in queries}
+    sweep(index, query_terms, load_qrels(dataset + '/qrels/train.tsv'),
+          query_terms, load_qrels(dataset + '/qrels/test.tsv'),
+          workers=multiprocessing.cpu_count(), output_file='bm25_sweep.json')
@@ -1,9 +1,9 @@
 import csv
 import sys
-import json
 import datetime
 import time
 from ranking import normalize_scores
+from runfile import write_run
 
 dataset = "scidocs"
 
@@ -22,39 +22,40 @@ def progress_bar(current, total, bar_length=50):
     sys.stdout.write(text)
     sys.stdout.flush()
 
-def writeResults(results_file, queries, bm25):
-    beir_results = {}
+def query_terms(query):
+    """
+    Terms to rank a parsed query with: its preprocessed tokens if present
+    """
+    if 'tokens' in query:
+        return query['tokens']
+    return query['title'] + query['query'] + query['narrative']
+
+def writeResults(results_file, queries, bm25, batch=False):
+    """
+    Rank every query with bm25 and write the results as a binary run (*.run), JSON or TREC lines.
+    With batch=True all queries are scored at once with BM25.search_batch.
+    """
     results_timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    count = 1
+    if batch:
+        batch_results = bm25.search_batch({query['num']: query_terms(query) for query in queries}, top_k=bm25.N)
 
-    with open(results_file, 'w') as output_file:
-        for query in queries:
+    def ranked_queries():
+        for count, query in enumerate(queries, start=1):
             query_id = query['num']
-            query_terms = query['title'] + query['query'] + query['narrative']
-            #print("Ranking Query " + str(query_id))
             progress_bar(count, len(queries))
-            ranked_docs = bm25.rank_documents(query_terms)
-            normalized_ranked_docs = normalize_scores(ranked_docs)
-            count = count + 1
-
-            if ('json' in results_file):
-                beir_results[query_id] = [(doc_id, score) for doc_id, score in normalized_ranked_docs]
+            if batch:
+                ranked_docs = list(batch_results[query_id].items())
             else:
-                # Write results to file in TREC eval format
-                for rank, (doc_id, score) in enumerate(normalized_ranked_docs, start=1):
-                    result_line = f"{query_id} Q0 {doc_id} {rank} {score} {results_timestamp}\n"
-                    output_file.write(result_line)
-        if ('json' in results_file):
-            json.dump(beir_results, output_file, indent=4)
-
-def save_results(results, output_file):
-    beir_results = {}
+                ranked_docs = bm25.rank_documents(query_terms(query))
+            yield query_id, normalize_scores(ranked_docs)
 
-    for query_id, docs in results.items():
-        beir_results[query_id] = [(doc_id, score) for doc_id, score in docs.items()]
+    write_run(results_file, ranked_queries(), tag=results_timestamp)
 
-    with open(output_file, 'w') as file:
-        json.dump(beir_results, file, indent=4)
+def save_results(results, output_file):
+    """
+    Write {query_id: {doc_id: score}} results in the format the file name selects (see runfile.write_run)
+    """
+    write_run(output_file, ((query_id, docs.items()) for query_id, docs in results.items()))
 
 
 #convert_tsv_to_qrels(dataset + '/qrels/test.tsv', dataset + '/qrels/test.qrels')